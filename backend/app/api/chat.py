@@ -1,55 +1,57 @@
-﻿from fastapi import APIRouter
+﻿from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
 import os
-from app.services.llm_providers import OpenAIProvider, OllamaProvider
+from app.core.config import settings
+from app.services.llm_providers import get_openai, get_ollama
+from app.api.sse import sse, relay
 router = APIRouter()
 PRIMARY = os.getenv("LLM_PRIMARY", "openai")  # "openai" or "ollama"
 class ChatIn(BaseModel):
     prompt: str
     system: str | None = None
     model: str | None = None
-def sse(event: str, data: str):
-    return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
 @router.post("/chat/stream")
-def chat_stream(body: ChatIn):
+async def chat_stream(body: ChatIn, request: Request):
     prompt, system = body.prompt, body.system
-    def gen():
+    async def gen():
         yield sse("typing", "start")
         # Try OpenAI first if configured
         if PRIMARY == "openai" and os.getenv("OPENAI_API_KEY"):
+            started = False
             try:
-                oa = OpenAIProvider(model=os.getenv("OPENAI_MODEL") or body.model)
-                text = oa.complete(prompt, system=system)  # non-stream call
-                if text:
-                    yield sse("token", text)
+                oa = get_openai(os.getenv("OPENAI_MODEL") or body.model)
+                async for delta in oa.astream(prompt, system=system):
+                    started = True
+                    yield sse("token", delta)
+                if started:
                     yield sse("done", "end")
                     return
             except Exception as e:
                 msg = str(e)
                 is_429 = ("429" in msg) or ("insufficient_quota" in msg)
-                if not is_429:
+                if started or not is_429:
                     yield sse("error", "openai_failed")
                     yield sse("done", "end")
                     return
                 # else: fall through to Ollama
         # Ollama (primary or fallback)
         try:
-            ol = OllamaProvider(model=os.getenv("LLM_MODEL") or body.model)
-            for delta in ol.stream(prompt, system=system):
+            ol = get_ollama(os.getenv("LLM_MODEL") or body.model)
+            async for delta in ol.astream(prompt, system=system):
                 yield sse("token", delta)
             yield sse("done", "end")
         except Exception:
             yield sse("error", "ollama_failed")
             yield sse("done", "end")
-    return StreamingResponse(gen(), media_type="text/event-stream")
+    return StreamingResponse(relay(request, gen(), settings.sse_heartbeat_s), media_type="text/event-stream")
 @router.post("/chat/complete")
-def chat_complete(body: ChatIn):
+async def chat_complete(body: ChatIn):
     prompt, system = body.prompt, body.system
     if PRIMARY == "openai" and os.getenv("OPENAI_API_KEY"):
         try:
-            oa = OpenAIProvider(model=os.getenv("OPENAI_MODEL") or body.model)
-            return JSONResponse({"reply": oa.complete(prompt, system=system)})
+            oa = get_openai(os.getenv("OPENAI_MODEL") or body.model)
+            return JSONResponse({"reply": await oa.acomplete(prompt, system=system)})
         except Exception as e:
             msg = str(e)
             is_429 = ("429" in msg) or ("insufficient_quota" in msg)
@@ -57,7 +59,7 @@ def chat_complete(body: ChatIn):
                 return JSONResponse({"error": "openai_failed"}, status_code=500)
             # else fall back
     try:
-        ol = OllamaProvider(model=os.getenv("LLM_MODEL") or body.model)
-        return JSONResponse({"reply": ol.complete(prompt, system=system)})
+        ol = get_ollama(os.getenv("LLM_MODEL") or body.model)
+        return JSONResponse({"reply": await ol.acomplete(prompt, system=system)})
     except Exception:
         return JSONResponse({"error": "ollama_failed"}, status_code=500)
@@ -2,17 +2,33 @@
 from fastapi.security import OAuth2PasswordBearer
 from bson import ObjectId
 from app.core.db import get_db
+from app.core.config import settings
 from app.core.security import decode_token
+from app.services.cache import TTLCache
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+_principals: TTLCache | None = None
+def _get_principals() -> TTLCache:
+    global _principals
+    if _principals is None:
+        _principals = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl_s)
+    return _principals
+def invalidate_principal(user_id: str):
+    """Call after changing a user's record so the next request sees it."""
+    _get_principals().invalidate(user_id)
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     user_id = decode_token(token)
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    db = get_db()
-    u = await db.users.find_one({"_id": ObjectId(user_id)})
-    if not u:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return {"id": str(u["_id"]), "email": u["email"], "full_name": u.get("full_name")}
+    cache = _get_principals()
+    principal = cache.get(user_id)
+    if principal is None:
+        db = get_db()
+        u = await db.users.find_one({"_id": ObjectId(user_id)}, {"email": 1, "full_name": 1})
+        if not u:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        principal = {"id": str(u["_id"]), "email": u["email"], "full_name": u.get("full_name")}
+        cache.set(user_id, principal)
+    return dict(principal)
 async def get_current_user_optional(token: str = Depends(oauth2_scheme)) -> dict | None:
     try:
         return await get_current_user(token)
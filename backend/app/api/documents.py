@@ -1,62 +1,97 @@
-﻿import os
+﻿import os, re, json, base64, asyncio
 from datetime import datetime
 from typing import List, Dict, Any
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from bson import ObjectId, regex
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from app.core.config import settings
 from app.core.db import get_db
-from app.ingestion.parsers import extract_text
-from app.ingestion.chunk import chunk_text
-from app.services.vector_store import add_documents
+from app.ingestion.storage import save_upload, UploadTooLarge
+from app.services.cache import TTLCache
+from app.services.analytics import log_event
+from app.services.jobs import enqueue_ingest, find_duplicate, get_job, job_view, QueueFull
 router = APIRouter()
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_document(file: UploadFile = File(...)):
-    if file.size and file.size > 100 * 1024 * 1024:
+    if file.size and file.size > settings.max_upload_bytes:
         raise HTTPException(status_code=413, detail="File too large")
-    os.makedirs(settings.file_storage_dir, exist_ok=True)
-    storage_path = os.path.join(settings.file_storage_dir, file.filename)
-    with open(storage_path, "wb") as f:
-        f.write(await file.read())
-    text = await extract_text(storage_path, file.content_type or "")
-    if not text.strip():
-        raise HTTPException(status_code=400, detail="No text extracted")
-    chunks = chunk_text(text)
-    db = get_db()
-    ext = os.path.splitext(file.filename)[1].lstrip(".").lower()
-    doc = {
-        "filename": file.filename,
-        "ext": ext,
-        "content_type": file.content_type,
-        "size": file.size,
-        "storage_path": storage_path,
-        "uploaded_at": datetime.utcnow(),
-        "chunk_count": len(chunks),
-    }
-    res = await db.documents.insert_one(doc)
-    doc_id = str(res.inserted_id)
-    ids = [f"{doc_id}:{i}" for i in range(len(chunks))]
-    metadatas = [{"document_id": doc_id, "chunk_index": i, "filename": file.filename} for i in range(len(chunks))]
-    docs = [c["text"] for c in chunks]
-    add_documents(ids, docs, metadatas)
-    return {"document_id": doc_id, "chunks": len(chunks)}
+    try:
+        storage_path, size, sha256 = await save_upload(
+            file, settings.file_storage_dir, settings.max_upload_bytes, settings.upload_chunk_bytes,
+            suffix=os.path.splitext(file.filename)[1].lower(),
+        )
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    # same bytes already ingested (or being ingested): skip the whole pipeline
+    dup = await find_duplicate(sha256)
+    if dup:
+        return dup
+    try:
+        job = await enqueue_ingest(storage_path, file.filename, file.content_type, size, sha256)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Ingestion queue is full, retry later")
+    except DuplicateKeyError:
+        # a concurrent upload of the same bytes claimed the hash first
+        dup = await find_duplicate(sha256)
+        if dup:
+            return dup
+        raise HTTPException(status_code=409, detail="Same file is being uploaded, retry later")
+    await log_event("document_uploaded", None, {"document_id": job["document_id"], "size": size})
+    return {"job_id": str(job["_id"]), "document_id": job["document_id"], "status": job["status"]}
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
+_counts: TTLCache | None = None
+def _get_counts() -> TTLCache:
+    global _counts
+    if _counts is None:
+        _counts = TTLCache(maxsize=1024, ttl=settings.documents_count_ttl_s)
+    return _counts
+_LIST_FIELDS = {"filename": 1, "ext": 1, "content_type": 1, "size": 1, "uploaded_at": 1, "chunk_count": 1}
+def _encode_cursor(d: Dict[str, Any]) -> str | None:
+    if not d.get("uploaded_at"):
+        return None
+    raw = json.dumps([d["uploaded_at"].isoformat(), str(d["_id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+def _decode_cursor(cursor: str):
+    try:
+        at, oid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(at), ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+async def _count(db, q: Dict[str, Any]) -> int:
+    # totals are approximate by design: exact counts over 1M+ rows would cost more than the page
+    if not q:
+        return await db.documents.estimated_document_count()
+    key = repr(sorted(q.items()))
+    total = _get_counts().get(key)
+    if total is None:
+        total = await db.documents.count_documents(q)
+        _get_counts().set(key, total)
+    return total
 @router.get("")
 async def list_documents(
-    search: str | None = Query(None, description="Case-insensitive search in filename"),
+    search: str | None = Query(None, description="Case-insensitive filename prefix"),
     ext: str | None = Query(None, description="Filter by extension: pdf|docx|txt|md"),
     date_from: str | None = Query(None, description="ISO date e.g. 2025-08-01"),
     date_to: str | None = Query(None, description="ISO date e.g. 2025-08-12"),
-    page: int = Query(1, ge=1),
+    cursor: str | None = Query(None, description="next_cursor from the previous page"),
+    page: int = Query(1, ge=1, description="Offset paging; prefer cursor for deep pages"),
     size: int = Query(20, ge=1, le=100),
 ):
     db = get_db()
     q: Dict[str, Any] = {}
+    search = " ".join((search or "").lower().split())
     if search:
-        q["filename"] = {"$regex": search, "$options": "i"}
+        # anchored on the lowercased name, so it is a range scan on the filename_lc index
+        q["filename_lc"] = {"$regex": "^" + re.escape(search)}
     if ext:
         q["ext"] = ext.lower()
     if date_from or date_to:
         rng = {}
-        from datetime import datetime
         if date_from:
             try: rng["$gte"] = datetime.fromisoformat(date_from)
             except: pass
@@ -64,9 +99,17 @@ async def list_documents(
             try: rng["$lte"] = datetime.fromisoformat(date_to)
             except: pass
         if rng: q["uploaded_at"] = rng
-    cursor = db.documents.find(q).sort("uploaded_at", -1).skip((page-1)*size).limit(size)
+    page_q = dict(q)
+    if cursor:
+        # rows strictly after the cursor in (uploaded_at desc, _id desc) order
+        at, oid = _decode_cursor(cursor)
+        page_q["$or"] = [{"uploaded_at": {"$lt": at}}, {"uploaded_at": at, "_id": {"$lt": oid}}]
+    find = db.documents.find(page_q, _LIST_FIELDS).sort([("uploaded_at", -1), ("_id", -1)])
+    if not cursor and page > 1:
+        find = find.skip((page-1)*size)
+    docs, total = await asyncio.gather(find.limit(size + 1).to_list(size + 1), _count(db, q))
     out: List[Dict[str, Any]] = []
-    async for d in cursor:
+    for d in docs[:size]:
         out.append({
             "id": str(d["_id"]),
             "filename": d.get("filename"),
@@ -76,5 +119,5 @@ async def list_documents(
             "uploaded_at": d.get("uploaded_at").isoformat() if d.get("uploaded_at") else None,
             "chunk_count": d.get("chunk_count"),
         })
-    total = await db.documents.count_documents(q)
-    return {"page": page, "size": size, "total": total, "items": out}
+    next_cursor = _encode_cursor(docs[size - 1]) if len(docs) > size else None
+    return {"page": page, "size": size, "total": total, "items": out, "next_cursor": next_cursor}
@@ -1,5 +1,13 @@
-﻿from fastapi import APIRouter
+﻿import asyncio
+from fastapi import APIRouter
+from app.services.vector_store import retrieval_cache_stats
+from app.services.llm import answer_cache_stats
+from app.services.analytics import event_buffer_stats
 router = APIRouter()
 @router.get("")
 async def health():
     return {"status": "ok"}
+@router.get("/metrics")
+async def metrics():
+    return {"retrieval_cache": retrieval_cache_stats(), "answer_cache": await asyncio.to_thread(answer_cache_stats),
+            "event_buffer": event_buffer_stats()}
@@ -1,12 +1,26 @@
-﻿from fastapi import APIRouter, HTTPException
-from app.services.llm import complete_with_fallback
-from fastapi.responses import PlainTextResponse
+﻿from fastapi import APIRouter, HTTPException, Request
+from app.services.llm import acomplete_with_fallback
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Literal
-import re
-from app.services.vector_store import similarity_search, get_chunks_by_document
-from app.services.llm import answer_with_context
+import re, asyncio, json
+from app.core.config import settings
+from app.api.sse import sse, relay
+from app.services.vector_store import asimilarity_search, aget_chunks_by_document
+from app.services.rerank import mmr
+import numpy as np
+from app.services.llm import answer_with_context, stream_answer, primary_model, _used_sources
+from app.services.context import pack_context, budget_for
+from app.services.singleflight import SingleFlight
+from app.services.summarize import restyle, sections
+from app.services.analytics import log_event
+from app.core.db import get_db
+from bson import ObjectId
 router = APIRouter()
+# identical concurrent asks/summaries share one retrieval + LLM call (or one token stream)
+_flights = SingleFlight()
+def _norm(q: str | None) -> str:
+    return " ".join((q or "").lower().split())
 FormatType = Literal["plain", "one_line", "lines", "text"]
 def _shape_answer(text: str, fmt: FormatType):
     if fmt == "one_line":
@@ -19,22 +33,77 @@ class AskBody(BaseModel):
     query: str
     document_id: str
     format: FormatType | None = "plain"
+    cache: bool = True  # False bypasses the answer cache
+async def _ask_hits(q: str, document_id: str):
+    try:
+        cands = await asimilarity_search(q, top_k=settings.mmr_fetch_k, document_id=document_id, with_embeddings=True)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Retrieval timed out")
+    cands = [h for h in cands if (h.get("text") or "").strip()]
+    if not cands:
+        return []
+    # diverse context: near-duplicate chunks (e.g. overlap regions) would otherwise fill the slots;
+    # relevance is the hybrid retriever's fused score, the vectors only judge redundancy
+    picked = mmr(None, np.stack([h["embedding"] for h in cands]), settings.mmr_k, settings.mmr_lambda,
+                 relevance=[h.get("score", 0.0) for h in cands])
+    return [{k: v for k, v in cands[i].items() if k != "embedding"} for i in picked]
+async def _summary_chunks(document_id: str):
+    try:
+        chunks = await aget_chunks_by_document(document_id, limit=100)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Retrieval timed out")
+    if not chunks:
+        raise HTTPException(status_code=404, detail="No chunks for document")
+    return sorted(chunks, key=lambda c: (c.get("metadata") or {}).get("chunk_index", 0))
+async def _summary_input(document_id: str):
+    """
+    (summary_tree, sources, hits) for a document. With a tree precomputed at ingest the hits are
+    its section summaries; without one (older documents, failed summarize stage) they are the
+    first chunks in document order.
+    """
+    doc = None
+    if ObjectId.is_valid(document_id):
+        doc = await get_db().documents.find_one({"_id": ObjectId(document_id)}, {"summary_tree": 1, "filename": 1})
+    tree = (doc or {}).get("summary_tree")
+    if tree:
+        sources = [{"id": f"{document_id}:{n['chunks'][0]}", "filename": doc.get("filename"),
+                    "chunk_index": n["chunks"][0], "chunks": n["chunks"]} for n in tree["levels"][0]]
+        return tree, sources, [{"text": n["summary"]} for n in sections(tree)]
+    chunks = (await _summary_chunks(document_id))[:20]
+    return None, _used_sources(chunks), chunks
+def _stream_rag(request: Request, key, query: str, hits, sources=None, stored: str | None = None):
+    # sources first (retrieval is already done), then the answer as it is generated
+    async def gen():
+        yield sse("sources", json.dumps(_used_sources(hits) if sources is None else sources))
+        if stored is not None:
+            yield sse("token", stored)
+        else:
+            try:
+                async for piece in stream_answer(query, hits):
+                    yield sse("token", piece)
+            except Exception:
+                yield sse("error", "llm_failed")
+        yield sse("done", "end")
+    events = _flights.stream(key, gen)
+    return StreamingResponse(relay(request, events, settings.sse_heartbeat_s), media_type="text/event-stream")
 @router.post("/knowledge/ask")
 async def ask(body: AskBody):
     q = (body.query or "").strip()
     if not q:
         raise HTTPException(status_code=400, detail="Empty query")
-    raw_hits = similarity_search(q, top_k=12, document_id=body.document_id)
-    seen, hits = set(), []
-    for h in raw_hits:
-        t = (h.get("text") or "").strip().lower()
-        if not t or t in seen:
-            continue
-        seen.add(t)
-        hits.append(h)
-        if len(hits) >= 8:
-            break
-    # Build context from the retrieved chunks
+    await log_event("question_asked", None, {"document_id": body.document_id})
+    fmt = (body.format or "plain")
+    key = ("ask", body.document_id, _norm(q), None, fmt, body.cache)
+    ans, used, usage = await _flights.do(key, lambda: _ask(q, body.document_id, body.cache))
+    if fmt == "text":
+        # Return true newlines as text/plain
+        return PlainTextResponse(ans)
+    return {"answer": _shape_answer(ans, fmt), "sources": used, "usage": usage}
+async def _ask(q: str, document_id: str, cache: bool):
+    hits = await _ask_hits(q, document_id)
+    # Build context from the retrieved chunks, packed into the answering model's token budget
+    budget = budget_for(primary_model())
+    hits, tokens = pack_context(hits, q, budget)
     context = "\n\n".join(f"[{i+1}] {h.get('text','')}" for i, h in enumerate(hits))
 
     prompt = f"""Answer the question using ONLY the context. If the answer isn't in the context, say you don't know.
@@ -48,9 +117,12 @@ async def ask(body: AskBody):
     Answer:"""
 
     # Call the provider (OpenAI→Ollama fallback)
-    ans = complete_with_fallback(
+    ans = await acomplete_with_fallback(
         prompt,
-        system="You are a concise assistant. Answer using only the provided context."
+        system="You are a concise assistant. Answer using only the provided context.",
+        use_cache=cache,
+        # same retrieved chunks + same question (modulo case/spacing) -> same answer
+        semantic_key="|".join(sorted(str(h.get("id")) for h in hits)) + "|" + " ".join(q.lower().split()),
     )
 
     # Shape sources from hits (keeps your old response shape)
@@ -62,24 +134,43 @@ async def ask(body: AskBody):
         }
         for h in hits
     ]
-
-    fmt = (body.format or "plain")
-    if fmt == "text":
-        # Return true newlines as text/plain
-        return PlainTextResponse(ans)
-    return {"answer": _shape_answer(ans, fmt), "sources": used}
+    return ans, used, {"context_tokens": tokens, "context_budget": budget}
 class SummarizeBody(BaseModel):
     document_id: str
     style: str | None = None
     format: FormatType | None = "plain"
+SUMMARY_QUERY = "Summarize this document into clear sections and a one-line takeaway."
 @router.post("/knowledge/summarize")
 async def summarize(body: SummarizeBody):
-    chunks = get_chunks_by_document(body.document_id, limit=100)
-    if not chunks:
-        raise HTTPException(status_code=404, detail="No chunks for document")
-    query = body.style or "Summarize this document into clear sections and a one-line takeaway."
-    ans, used = answer_with_context(query, chunks[:20])
     fmt = (body.format or "plain")
+    key = ("summarize", body.document_id, None, _norm(body.style), fmt)
+    ans, used = await _flights.do(key, lambda: _summarize(body.document_id, body.style))
     if fmt == "text":
         return PlainTextResponse(ans)
     return {"answer": _shape_answer(ans, fmt), "sources": used}
+async def _summarize(document_id: str, style: str | None):
+    tree, sources, hits = await _summary_input(document_id)
+    if tree and not style:
+        return tree["summary"], sources
+    if tree:
+        try:
+            return await restyle(tree, style), sources
+        except Exception:
+            pass  # no LLM reachable; answer_with_context has its own fallback text
+    ans, _ = await asyncio.to_thread(answer_with_context, style or SUMMARY_QUERY, hits)
+    return ans, sources
+@router.post("/knowledge/ask/stream")
+async def ask_stream(body: AskBody, request: Request):
+    q = (body.query or "").strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty query")
+    await log_event("question_asked", None, {"document_id": body.document_id, "stream": True})
+    key = ("ask/stream", body.document_id, _norm(q), None, None)
+    hits = await _flights.do(key, lambda: _ask_hits(q, body.document_id))
+    return _stream_rag(request, key, q, hits)
+@router.post("/knowledge/summarize/stream")
+async def summarize_stream(body: SummarizeBody, request: Request):
+    key = ("summarize/stream", body.document_id, None, _norm(body.style), None)
+    tree, sources, hits = await _flights.do(key, lambda: _summary_input(body.document_id))
+    stored = tree["summary"] if tree and not body.style else None
+    return _stream_rag(request, key, body.style or SUMMARY_QUERY, hits, sources, stored)
@@ -0,0 +1,43 @@
+import asyncio
+from typing import AsyncIterator
+from fastapi import Request
+_END = object()
+def sse(event: str, data: str):
+    # multi-line payloads need one data: field per line
+    body = "\n".join(f"data: {line}" for line in str(data).split("\n"))
+    return f"event: {event}\n{body}\n\n".encode("utf-8")
+async def relay(request: Request, events: AsyncIterator[bytes], heartbeat_s: float) -> AsyncIterator[bytes]:
+    """
+    Forward pre-encoded SSE events from `events`, sending a `ping` event whenever the producer
+    has been silent for heartbeat_s. The producer runs as its own task; when the client goes away
+    (disconnect seen on a heartbeat tick, or Starlette cancelling the response) that task is
+    cancelled, which closes the upstream model request.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+    async def pump():
+        try:
+            async for ev in events:
+                await queue.put(ev)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(_END)
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=heartbeat_s)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield sse("ping", "")
+                continue
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await events.aclose()
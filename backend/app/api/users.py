@@ -1,6 +1,6 @@
 ﻿from fastapi import APIRouter, Depends
 from bson import ObjectId
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, invalidate_principal
 from app.core.db import get_db
 from app.schemas.user import UserUpdate
 router = APIRouter()
@@ -17,5 +17,6 @@ async def update_me(body: UserUpdate, user=Depends(get_current_user)):
         update["settings"] = body.settings
     if update:
         await db.users.update_one({"_id": ObjectId(user["id"])}, {"$set": update})
+        invalidate_principal(user["id"])
     u = await db.users.find_one({"_id": ObjectId(user["id"])})
     return {"id": user["id"], "email": u["email"], "full_name": u.get("full_name"), "settings": u.get("settings", {})}
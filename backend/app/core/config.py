@@ -1,14 +1,79 @@
-﻿from typing import List
+﻿from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=False, extra="ignore")
     openai_api_key: str | None = None
+    llm_provider: str = "openai"
+    ollama_base_url: str = "http://127.0.0.1:11434"
+    ollama_model: str = "llama3.1"
     mongo_uri: str = "mongodb://localhost:27017"
     mongo_db: str = "bkp"
     jwt_secret: str = "please_change_me"
     jwt_expire_minutes: int = 60
+    password_hash_workers: int = 2  # bcrypt runs on its own pool
+    principal_cache_ttl_s: float = 60.0  # how long a user record / decoded token is reused
+    principal_cache_size: int = 10000
+    token_cache_size: int = 10000
     allowed_origins: List[str] = ["http://localhost:5173", "http://127.0.0.1:8010", "http://localhost:8010"]
     chroma_host: str = "localhost"
     chroma_port: int = 8001
+    vector_backend: str = "chroma"  # "chroma" (HttpClient) or "local" (in-process mmap index)
+    vector_store_dir: str = "vector_data"
+    vector_segment_rows: int = 65536
+    vector_ivf_threshold: int = 50000
+    vector_ivf_lists: int = 0  # 0 -> sqrt(rows)
+    vector_ivf_nprobe: int = 8
+    vector_write_batch: int = 256
+    vector_write_retries: int = 3
+    vector_query_workers: int = 8
+    vector_query_timeout_s: float = 10.0
+    bm25_enabled: bool = True  # hybrid BM25 + vector retrieval
+    bm25_dir: str = "bm25_data"
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    hybrid_candidates: int = 50  # per list, before fusion
+    rrf_k: int = 60
+    mmr_fetch_k: int = 20  # candidates reranked by MMR in /knowledge/ask
+    mmr_k: int = 6  # chunks kept for the prompt
+    mmr_lambda: float = 0.7  # 1.0 = relevance only, 0.0 = diversity only
+    context_tokenizer: str = "cl100k_base"  # tiktoken encoding, or "heuristic" (~4 chars/token)
+    context_budget_tokens: int = 2000  # prompt-context budget for models not in context_budgets
+    context_budgets: Dict[str, int] = {"gpt-4o-mini": 6000, "o4-mini": 6000}
+    context_min_window: int = 64  # stop packing below this many free tokens
+    retrieval_cache_backend: str = "memory"  # "memory", "mongo" (shared across workers) or "off"
+    retrieval_cache_size: int = 2048
+    retrieval_cache_ttl_s: float = 600.0
+    embedding_cache_size: int = 8192  # chunk vectors kept by id for MMR on retrieval-cache hits
+    llm_pool_max_connections: int = 50
+    llm_pool_max_keepalive: int = 20
+    llm_keepalive_expiry_s: float = 60.0
+    llm_timeout_s: float = 120.0
+    llm_provider_cache_size: int = 16  # provider objects kept per (kind, model); request-chosen models are LRU-evicted
+    sse_heartbeat_s: float = 15.0
+    answer_cache_enabled: bool = True
+    answer_cache_path: str = "answer_cache.sqlite3"
+    answer_cache_ttl_s: float = 86400.0
+    answer_cache_max_entries: int = 10000
+    event_buffer_size: int = 10000
+    event_batch_size: int = 500
+    event_flush_interval_s: float = 1.0
+    event_overflow: str = "drop"  # "drop" (count and discard) or "block" (caller waits for room)
+    analytics_cache_ttl_s: float = 30.0  # GET /analytics/summary result cache
+    documents_count_ttl_s: float = 30.0  # cached list totals for filtered queries
+    max_upload_bytes: int = 100 * 1024 * 1024
+    upload_chunk_bytes: int = 1024 * 1024
+    parse_workers: int = 2  # 0 -> one per CPU
+    parse_timeout_s: float = 120.0
+    parse_pdf_pages_per_task: int = 50
+    ingest_workers: int = 2
+    ingest_queue_size: int = 100
+    ingest_stage_retries: int = 2
+    ingest_retry_backoff_s: float = 1.0
+    summary_enabled: bool = True  # precompute a map-reduce summary tree at ingest
+    summary_group_chunks: int = 8
+    summary_fanin: int = 8
+    summary_concurrency: int = 4
+    summary_workers: int = 1  # summary trees are built off the ingest workers, after the job is done
+    summary_queue_size: int = 100
     file_storage_dir: str = r"C:\Users\NAMAN GOYAl\bkp-mongo-starter\data\files"
 settings = Settings()
@@ -1,20 +1,50 @@
-﻿from datetime import datetime, timedelta, timezone
+﻿import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.services.cache import TTLCache
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGO = "HS256"
+_pw_pool: ThreadPoolExecutor | None = None
+_tokens: TTLCache | None = None
 def hash_password(pw: str) -> str:
     return pwd_context.hash(pw)
 def verify_password(pw: str, hashed: str) -> bool:
     return pwd_context.verify(pw, hashed)
+def _get_pw_pool() -> ThreadPoolExecutor:
+    # bcrypt is deliberately slow (~250 ms); a small dedicated pool keeps login bursts off the
+    # event loop and out of the default executor that retrieval and parsing share
+    global _pw_pool
+    if _pw_pool is None:
+        _pw_pool = ThreadPoolExecutor(max_workers=max(1, settings.password_hash_workers), thread_name_prefix="bcrypt")
+    return _pw_pool
+async def ahash_password(pw: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_get_pw_pool(), hash_password, pw)
+async def averify_password(pw: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_get_pw_pool(), verify_password, pw, hashed)
+def _get_tokens() -> TTLCache:
+    global _tokens
+    if _tokens is None:
+        _tokens = TTLCache(maxsize=settings.token_cache_size, ttl=settings.principal_cache_ttl_s)
+    return _tokens
 def create_access_token(sub: str, minutes: int | None = None) -> str:
     expire = datetime.now(timezone.utc) + timedelta(minutes=minutes or settings.jwt_expire_minutes)
     to_encode = {"sub": sub, "exp": expire}
     return jwt.encode(to_encode, settings.jwt_secret, algorithm=ALGO)
 def decode_token(token: str) -> str | None:
+    # valid tokens are memoized until they expire, so repeat requests skip the signature check
+    cache = _get_tokens()
+    sub = cache.get(token)
+    if sub is not None:
+        return sub
     try:
         payload = jwt.decode(token, settings.jwt_secret, algorithms=[ALGO])
-        return payload.get("sub")
     except JWTError:
         return None
+    sub = payload.get("sub")
+    left = payload.get("exp", 0) - time.time()
+    if sub and left > 0:
+        cache.set(token, sub, ttl=min(left, settings.principal_cache_ttl_s))
+    return sub
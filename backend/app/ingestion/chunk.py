@@ -1,8 +1,74 @@
 ﻿import re
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List
+_PARA_SEP = re.compile(r"\n\s*\n")
 def _split_paragraphs(text: str) -> List[str]:
     # split on blank lines, keep non-empty
-    return [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    return [p.strip() for p in _PARA_SEP.split(text) if p.strip()]
+def iter_paragraphs(pieces: Iterable[str], sep: str = "") -> Iterator[str]:
+    """
+    Incremental _split_paragraphs over the text sep.join(pieces), without materializing it.
+    A blank-line separator may straddle pieces, so the trailing whitespace of what has been
+    read so far is carried over and checked together with the next piece's leading whitespace.
+    """
+    parts: List[str] = []  # current (unfinished) paragraph
+    ws = ""                # whitespace after the last non-space character seen
+    first = True
+    for piece in pieces:
+        if sep and not first:
+            piece = sep + piece
+        first = False
+        body = piece.lstrip()
+        ws += piece[:len(piece) - len(body)]
+        if not body:
+            continue
+        if ws.count("\n") >= 2:
+            para = "".join(parts).strip()
+            if para:
+                yield para
+            parts = []
+        elif parts:
+            parts.append(ws)
+        segs = _PARA_SEP.split(body)
+        parts.append(segs[0])
+        for seg in segs[1:]:
+            para = "".join(parts).strip()
+            if para:
+                yield para
+            parts = [seg]
+        last = parts[-1].rstrip()
+        ws = parts[-1][len(last):]
+        parts[-1] = last
+    para = "".join(parts).strip()
+    if para:
+        yield para
+def iter_chunks(pieces: Iterable[str], chunk_size: int = 1200, overlap: int = 200, sep: str = "") -> Iterator[Dict]:
+    """
+    Streaming chunk_text: consumes text pieces (pages, paragraphs, file blocks) and yields each
+    chunk as soon as it is full. Output is identical to chunk_text(sep.join(pieces)) for
+    non-empty text.
+    """
+    idx = 0
+    buf: List[str] = []
+    buf_len = 0
+    for p in iter_paragraphs(pieces, sep):
+        if buf_len + len(p) + (2 if buf else 0) <= chunk_size:
+            buf_len += len(p) + (2 if buf else 0)
+            buf.append(p)
+            continue
+        if buf:
+            yield {"chunk_index": idx, "text": "\n\n".join(buf)}
+            idx += 1
+        # long paragraph → hard split
+        if len(p) > chunk_size:
+            step = max(1, chunk_size - overlap)
+            for i in range(0, len(p), step):
+                yield {"chunk_index": idx, "text": p[i:i + chunk_size]}
+                idx += 1
+            buf, buf_len = [], 0
+        else:
+            buf, buf_len = [p], len(p)
+    if buf:
+        yield {"chunk_index": idx, "text": "\n\n".join(buf)}
 def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[Dict]:
     """
     Greedy paragraph packing into ~chunk_size characters.
@@ -11,23 +77,4 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[Di
     """
     if not text:
         return [{"chunk_index": 0, "text": ""}]
-    paras = _split_paragraphs(text)
-    chunks: List[str] = []
-    buf = ""
-    for p in paras:
-        if len(buf) + len(p) + (2 if buf else 0) <= chunk_size:
-            buf = f"{buf}\n\n{p}" if buf else p
-        else:
-            if buf:
-                chunks.append(buf)
-            # long paragraph → hard split
-            if len(p) > chunk_size:
-                step = max(1, chunk_size - overlap)
-                for i in range(0, len(p), step):
-                    chunks.append(p[i:i + chunk_size])
-                buf = ""
-            else:
-                buf = p
-    if buf:
-        chunks.append(buf)
-    return [{"chunk_index": i, "text": c} for i, c in enumerate(chunks)]
+    return list(iter_chunks([text], chunk_size, overlap))
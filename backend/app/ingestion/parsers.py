@@ -1,22 +1,91 @@
-﻿from typing import Tuple
-import os
+﻿from typing import Dict, List, Set, Tuple
+import os, asyncio, multiprocessing, threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
 from pypdf import PdfReader
 from docx import Document
+from app.core.config import settings
+_pool: ProcessPoolExecutor | None = None
+_inflight: Dict[ProcessPoolExecutor, Set[Future]] = {}
+PARSE_TIMEOUT = "[PARSE_ERROR] parse timed out"
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork the server process (motor/uvicorn threads)
+        _pool = ProcessPoolExecutor(max_workers=settings.parse_workers or None,
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+def _submit(mine: List[Tuple[ProcessPoolExecutor, Future]], fn, *args) -> asyncio.Future:
+    pool = _get_pool()
+    fut = pool.submit(fn, *args)
+    live = _inflight.setdefault(pool, set())
+    live.add(fut)
+    fut.add_done_callback(live.discard)
+    mine.append((pool, fut))
+    return asyncio.wrap_future(fut)
+def _retire(mine: List[Tuple[ProcessPoolExecutor, Future]]):
+    """
+    Get rid of a timed-out parse. Its running task can only be stopped by killing its worker, and
+    killing any worker breaks the whole executor, so the pools it still runs on are retired instead:
+    new parses go to a fresh pool at once, other parses already running on the old one finish
+    there, and its workers are killed after that (or after another parse_timeout_s).
+    """
+    global _pool
+    stuck = {pool for pool, f in mine if not f.cancel() and not f.done()}
+    for pool in stuck:
+        if _pool is pool:
+            _pool = None
+        others = _inflight.get(pool, set()) - {f for _, f in mine}
+        def reap(pool=pool, others=others):
+            wait(others, timeout=settings.parse_timeout_s)
+            for proc in list((getattr(pool, "_processes", None) or {}).values()):
+                proc.kill()
+            pool.shutdown(wait=False, cancel_futures=True)
+            _inflight.pop(pool, None)
+        threading.Thread(target=reap, name="parse-reaper", daemon=True).start()
+def shutdown_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
 async def extract_text(path: str, content_type: str | None = "") -> str:
+    return "\n\n".join(await extract_pages(path, content_type)).strip()
+async def extract_pages(path: str, content_type: str | None = "") -> List[str]:
+    """
+    Text as a list of pieces whose "\n\n"-join is extract_text(): one entry per non-empty PDF
+    page, a single entry for everything else. Feed to ingestion.chunk.iter_chunks(..., sep="\n\n").
+    """
     # Decide by MIME or extension
     ext = os.path.splitext(path)[1].lower()
     ctype = (content_type or "").lower()
+    mine: List[Tuple[ProcessPoolExecutor, Future]] = []
     try:
-        if ext == ".pdf" or "pdf" in ctype:
-            return _from_pdf(path)
-        if ext == ".docx" or "wordprocessingml.document" in ctype:
-            return _from_docx(path)
-        if ext == ".md" or "markdown" in ctype:
-            return _from_text(path)  # treat MD as plain text
-        # default: TXT / unknown -> plain text
-        return _from_text(path)
+        return await asyncio.wait_for(_extract(path, ext, ctype, mine), timeout=settings.parse_timeout_s)
+    except asyncio.TimeoutError:
+        _retire(mine)
+        return [f"{PARSE_TIMEOUT} after {settings.parse_timeout_s}s"]
     except Exception as e:
-        return f"[PARSE_ERROR] {e}"
+        return [f"[PARSE_ERROR] {e}"]
+async def _extract(path: str, ext: str, ctype: str, mine) -> List[str]:
+    if ext == ".pdf" or "pdf" in ctype:
+        return await _pdf_parts(path, mine)
+    if ext == ".docx" or "wordprocessingml.document" in ctype:
+        return [await _submit(mine, _from_docx, path)]
+    if ext == ".md" or "markdown" in ctype:
+        return [await asyncio.to_thread(_from_text, path)]  # treat MD as plain text
+    # default: TXT / unknown -> plain text (I/O bound, no need for a process)
+    return [await asyncio.to_thread(_from_text, path)]
+async def _pdf_parts(path: str, mine) -> List[str]:
+    """
+    Non-empty page texts in page order. The first range also reports the page count; PDFs longer
+    than settings.parse_pdf_pages_per_task are split into page ranges extracted in parallel.
+    """
+    step = max(1, settings.parse_pdf_pages_per_task)
+    first, total = await _submit(mine, _pdf_pages, path, 0, step)
+    rest = await asyncio.gather(*(
+        _submit(mine, _pdf_pages, path, start, min(start + step, total))
+        for start in range(step, total, step)
+    ))
+    return first + [t for part, _ in rest for t in part]
 def _from_text(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
@@ -28,12 +97,12 @@ def _from_docx(path: str) -> str:
         if t:
             lines.append(t)
     return "\n".join(lines)
-def _from_pdf(path: str) -> str:
+def _pdf_pages(path: str, start: int, end: int) -> Tuple[List[str], int]:
     # text-based PDFs; for scanned PDFs, add OCR later if needed
     reader = PdfReader(path)
     parts = []
-    for page in reader.pages:
+    for page in reader.pages[start:end]:
         t = (page.extract_text() or "").strip()
         if t:
             parts.append(t)
-    return "\n\n".join(parts).strip()
+    return parts, len(reader.pages)
@@ -0,0 +1,43 @@
+import os, hashlib, tempfile
+from typing import Tuple
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+class UploadTooLarge(Exception):
+    pass
+async def save_upload(file: UploadFile, dest_dir: str, max_bytes: int, chunk_size: int = 1024 * 1024,
+                      suffix: str = "") -> Tuple[str, int, str]:
+    """
+    Stream an upload into dest_dir in fixed-size chunks. The byte limit is enforced while reading
+    (file.size may be None), a SHA-256 is computed on the fly, and the temp file is atomically
+    renamed to dest_dir/<sha256><suffix> once complete, so identical bytes share one stored file.
+    Returns (path, size, sha256_hex).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        sha256 = digest.hexdigest()
+        path = os.path.join(dest_dir, f"{sha256}{suffix}")
+        if os.path.exists(path):
+            # same bytes are already stored; don't rewrite a file an ingest may be reading
+            os.unlink(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path, size, sha256
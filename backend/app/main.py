@@ -3,7 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.core.db import get_db
 from fastapi.openapi.utils import get_openapi
-from app.api import health, documents, auth, chat
+from app.api import health, documents, auth, chat, knowledge, analytics
+from app.ingestion.parsers import shutdown_pool
+from app.services.jobs import start_workers, stop_workers
+from app.services.llm_providers import aclose_providers
+from app.services.analytics import ensure_rollups, start_event_buffer, stop_event_buffer
+from app.services.context import warm_encoding
+from pymongo.errors import OperationFailure
+import asyncio
 app = FastAPI(title="Business Knowledge Platform", version="0.2.0")
 def custom_openapi():
     if app.openapi_schema:
@@ -36,12 +43,46 @@ app.add_middleware(
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(chat.router, prefix="/api", tags=["chat"])
+app.include_router(knowledge.router, prefix="/api", tags=["knowledge"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
 app.include_router(health.router, prefix="/api", tags=["health"])
+_background = []
 @app.on_event("startup")
 async def startup():
     db = get_db()
     await db.users.create_index("email", unique=True)
     await db.events.create_index([("created_at", 1)])
     await db.events.create_index([("type", 1)])
+    await db.events_daily.create_index([("date", 1)])
+    await db.events_hourly.create_index([("hour", 1)])
     await db.documents.create_index([("uploaded_at", -1)])
+    # keyset paging and prefix search for GET /api/documents
+    await db.documents.create_index([("uploaded_at", -1), ("_id", -1)])
+    await db.documents.create_index([("filename_lc", 1), ("uploaded_at", -1), ("_id", -1)])
+    await db.documents.create_index([("ext", 1), ("uploaded_at", -1), ("_id", -1)])
     await db.documents.create_index([("filename", "text")])
+    await db.documents.create_index([("sha256", 1)])
+    await db.jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.jobs.create_index([("file.sha256", 1)])
+    # at most one queued/running job per content hash: concurrent uploads of the same bytes race
+    # past find_duplicate, and the loser's insert fails instead of ingesting the file twice
+    try:
+        await db.jobs.create_index([("file.sha256", 1)], name="active_sha256", unique=True,
+                                   partialFilterExpression={"status": {"$in": ["queued", "running"]}})
+    except OperationFailure:
+        pass  # duplicate active jobs from before the index existed; retried on the next startup
+    warm_encoding()
+    await start_event_buffer()
+    await start_workers()
+    _background.append(asyncio.create_task(ensure_rollups()))
+@app.on_event("shutdown")
+async def shutdown():
+    # ensure_rollups may be sleeping on its next pass; don't leave it pending on a closing loop
+    for t in _background:
+        t.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    _background.clear()
+    await stop_workers()
+    await stop_event_buffer()
+    shutdown_pool()
+    await aclose_providers()
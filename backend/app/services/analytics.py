@@ -1,26 +1,217 @@
 ﻿from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from typing import Any, Dict, List
+import asyncio
+from pymongo import UpdateOne
+from app.core.config import settings
 from app.core.db import get_db
-async def log_event(evt_type: str, user_id: str | None, payload: Dict[str, Any] | None = None):
+from app.services.cache import TTLCache
+_summary_cache: TTLCache | None = None
+def _get_summary_cache() -> TTLCache:
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = TTLCache(maxsize=128, ttl=settings.analytics_cache_ttl_s)
+    return _summary_cache
+def _day(at: datetime) -> str:
+    return at.strftime("%Y-%m-%d")
+def _hour(at: datetime) -> str:
+    return at.strftime("%Y-%m-%dT%H")
+def _rollup_ops(counts: Dict[tuple, int]) -> Dict[str, List[UpdateOne]]:
+    """Upserted $inc ops for events_daily / events_hourly from {(type, hour): n}."""
+    daily: Dict[tuple, int] = {}
+    for (evt_type, hour), n in counts.items():
+        daily[(evt_type, hour[:10])] = daily.get((evt_type, hour[:10]), 0) + n
+    return {
+        "events_hourly": [UpdateOne({"_id": f"{t}|{h}"}, {"$inc": {"count": n}, "$setOnInsert": {"type": t, "hour": h}}, upsert=True)
+                          for (t, h), n in counts.items()],
+        "events_daily": [UpdateOne({"_id": f"{t}|{d}"}, {"$inc": {"count": n}, "$setOnInsert": {"type": t, "date": d}}, upsert=True)
+                         for (t, d), n in daily.items()],
+    }
+async def _apply_rollups(counts: Dict[tuple, int]):
     db = get_db()
-    await db.events.insert_one({
+    await asyncio.gather(*[db[name].bulk_write(ops, ordered=False) for name, ops in _rollup_ops(counts).items() if ops])
+async def _write_events(events: List[Dict[str, Any]]):
+    await get_db().events.insert_many(events, ordered=False)
+    counts: Dict[tuple, int] = {}
+    for e in events:
+        key = (e["type"], _hour(e["created_at"]))
+        counts[key] = counts.get(key, 0) + 1
+    await _apply_rollups(counts)
+class EventBuffer:
+    """
+    Bounded in-process queue of analytics events, written by one background task with
+    insert_many(ordered=False) once `batch_size` events are waiting or `flush_interval_s` after the
+    first one arrived. When full, `policy` decides: "drop" discards the new event (counted), "block"
+    makes the caller wait for room. stop() writes everything still queued.
+    """
+    def __init__(self, maxsize: int = 10000, batch_size: int = 500, flush_interval_s: float = 1.0, policy: str = "drop"):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.policy = policy
+        self._q: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: asyncio.Task | None = None
+        self.enqueued = self.written = self.dropped = self.write_errors = self.flushes = 0
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    async def stop(self):
+        if self.running:
+            await self._q.put(None)  # sentinel: everything queued before it gets written
+            await self._task
+        self._task = None
+    def put_nowait(self, event: Dict[str, Any]) -> bool:
+        try:
+            self._q.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+    async def put(self, event: Dict[str, Any]) -> bool:
+        if self.policy != "block":
+            return self.put_nowait(event)
+        await self._q.put(event)
+        self.enqueued += 1
+        return True
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            await _write_events(batch)
+            self.written += len(batch)
+        except Exception:
+            self.write_errors += len(batch)  # analytics are best-effort; never stall the writer
+        self.flushes += 1
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._q.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = loop.time() + self.flush_interval_s
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._q.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._q.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stop:
+                return
+    def stats(self) -> Dict[str, Any]:
+        return {"depth": self._q.qsize(), "maxsize": self._q.maxsize, "policy": self.policy,
+                "enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+                "write_errors": self.write_errors, "flushes": self.flushes}
+_buffer: EventBuffer | None = None
+async def start_event_buffer():
+    global _buffer
+    _buffer = EventBuffer(settings.event_buffer_size, settings.event_batch_size,
+                          settings.event_flush_interval_s, settings.event_overflow)
+    _buffer.start()
+async def stop_event_buffer():
+    if _buffer is not None:
+        await _buffer.stop()
+def event_buffer_stats() -> Dict[str, Any]:
+    return _buffer.stats() if _buffer is not None else {"running": False}
+async def log_event(evt_type: str, user_id: str | None, payload: Dict[str, Any] | None = None):
+    """Queue an event for the background writer; written directly when the buffer is not running."""
+    event = {
         "type": evt_type,
         "user_id": user_id,
         "payload": payload or {},
         "created_at": datetime.now(timezone.utc),
-    })
+    }
+    if _buffer is not None and _buffer.running:
+        await _buffer.put(event)
+    else:
+        await _write_events([event])
+def _settled_before(settle_s: float) -> datetime:
+    # start of the newest hour no event still in flight (buffered, being written) can belong to
+    return (datetime.now(timezone.utc) - timedelta(seconds=settle_s)).replace(minute=0, second=0, microsecond=0)
+async def rebuild_rollups(settle_s: float = 60.0):
+    """
+    Reconcile events_daily / events_hourly with the raw events (backfill, or repair after a crash)
+    for every hour that ended at least `settle_s` ago. Rollups are corrected by $inc-ing the
+    difference from a recount rather than rewritten, so this is safe while events are being
+    written: live writes only touch newer hours, and $incs commute.
+    """
+    db = get_db()
+    cutoff = _settled_before(settle_s)
+    cut_hour, cut_day = _hour(cutoff), _day(cutoff)
+    pipeline = [{"$match": {"created_at": {"$lt": cutoff}}},
+                {"$group": {"_id": {"type": "$type", "hour": {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$created_at"}}},
+                            "n": {"$sum": 1}}}]
+    want: Dict[tuple, int] = {}
+    async for row in db.events.aggregate(pipeline, allowDiskUse=True):
+        want[(row["_id"]["type"], row["_id"]["hour"])] = row["n"]
+    have = {(r["type"], r["hour"]): r["count"] async for r in db.events_hourly.find({"hour": {"$lt": cut_hour}})}
+    hourly = {k: want.get(k, 0) - have.get(k, 0) for k in want.keys() | have.keys()}
+    # whole days before the cutoff are compared directly (hourly and daily rows can disagree
+    # after a crash between the two writes); the cutoff's own day gets its settled hours' delta
+    want_daily: Dict[tuple, int] = {}
+    for (t, h), n in want.items():
+        if h[:10] < cut_day:
+            want_daily[(t, h[:10])] = want_daily.get((t, h[:10]), 0) + n
+    have_daily = {(r["type"], r["date"]): r["count"] async for r in db.events_daily.find({"date": {"$lt": cut_day}})}
+    daily = {k: want_daily.get(k, 0) - have_daily.get(k, 0) for k in want_daily.keys() | have_daily.keys()}
+    for (t, h), n in hourly.items():
+        if h[:10] == cut_day:
+            daily[(t, cut_day)] = daily.get((t, cut_day), 0) + n
+    ops = {
+        "events_hourly": [UpdateOne({"_id": f"{t}|{h}"}, {"$inc": {"count": n}, "$setOnInsert": {"type": t, "hour": h}}, upsert=True)
+                          for (t, h), n in hourly.items() if n],
+        "events_daily": [UpdateOne({"_id": f"{t}|{d}"}, {"$inc": {"count": n}, "$setOnInsert": {"type": t, "date": d}}, upsert=True)
+                         for (t, d), n in daily.items() if n],
+    }
+    await asyncio.gather(*[db[name].bulk_write(o, ordered=False) for name, o in ops.items() if o])
+    _get_summary_cache().clear()
+async def ensure_rollups(settle_s: float = 60.0):
+    # first start after the rollups were introduced: derive them from the existing events, then
+    # once more when the hour in progress has settled (its earlier events predate the rollups)
+    db = get_db()
+    if not await db.events_daily.find_one({}, {"_id": 1}) and await db.events.find_one({}, {"_id": 1}):
+        await rebuild_rollups(settle_s)
+        wait = (_settled_before(0) + timedelta(hours=1, seconds=settle_s) - datetime.now(timezone.utc)).total_seconds()
+        await asyncio.sleep(max(0.0, wait))
+        await rebuild_rollups(settle_s)
 async def summary(days: int = 7):
+    """
+    Dashboard totals over the last `days` days, read from the rollups: hourly rows for the partial
+    first day (hour resolution), daily rows after it. O(days) reads however many events there are.
+    """
+    cache = _get_summary_cache()
+    hit = cache.get(days)
+    if hit is not None:
+        return hit
     db = get_db()
     since = datetime.now(timezone.utc) - timedelta(days=days)
-    total_users = await db.users.count_documents({})
-    uploads = await db.events.count_documents({"type": "document_uploaded", "created_at": {"$gte": since}})
-    questions = await db.events.count_documents({"type": "question_asked", "created_at": {"$gte": since}})
-    pipeline = [
-        {"$match": {"created_at": {"$gte": since}}},
-        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "events": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]
-    per_day = []
-    async for row in db.events.aggregate(pipeline):
-        per_day.append({"date": row["_id"], "events": row["events"]})
-    return {"since": since.isoformat(), "totals": {"users": total_users, "uploads": uploads, "questions": questions}, "per_day": per_day}
+    first_day = _day(since)
+    hourly = db.events_hourly.find({"hour": {"$gte": _hour(since), "$lt": _day(since + timedelta(days=1))}})
+    daily = db.events_daily.find({"date": {"$gt": first_day}})
+    total_users, hourly, daily = await asyncio.gather(
+        db.users.estimated_document_count(), hourly.to_list(None), daily.to_list(None))
+    by_type: Dict[str, int] = {}
+    by_day: Dict[str, int] = {}
+    for row in hourly + daily:
+        date = row.get("date") or row["hour"][:10]
+        by_type[row["type"]] = by_type.get(row["type"], 0) + row["count"]
+        by_day[date] = by_day.get(date, 0) + row["count"]
+    per_day = [{"date": d, "events": by_day[d]} for d in sorted(by_day) if by_day[d]]
+    out = {"since": since.isoformat(),
+           "totals": {"users": total_users, "uploads": by_type.get("document_uploaded", 0),
+                      "questions": by_type.get("question_asked", 0)},
+           "per_day": per_day}
+    cache.set(days, out)
+    return out
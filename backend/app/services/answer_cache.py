@@ -0,0 +1,65 @@
+import hashlib, os, sqlite3, threading, time
+from typing import Any, Dict, Optional
+def fingerprint(*parts: Optional[str]) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update((p or "").encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+class AnswerCache:
+    """
+    Persistent LLM answer cache in a local SQLite file (WAL, so several workers can share it).
+    Entries expire after `ttl` seconds; beyond `max_entries` the least recently used are dropped
+    (checked every 100 writes, so the table may briefly overshoot the cap).
+    """
+    def __init__(self, path: str, ttl: float = 86400.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, model TEXT, answer TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+    def get(self, *keys: str) -> Optional[str]:
+        """Answer for the first live key (e.g. exact fingerprint, then a looser one); one hit/miss per call."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._db.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] + self.ttl >= now:
+                    self._db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+    def put(self, key: str, answer: str, model: str | None = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, model, answer, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, answer, now, now),
+            )
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._trim(now)
+    def _trim(self, now: float):
+        self._db.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"backend": "sqlite", "size": size, "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else None}
@@ -0,0 +1,141 @@
+import os, re, json, math, threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+_WORD = re.compile(r"\w+")
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+class _Shard:
+    """Postings for one document_id: term -> (row array, term-frequency array)."""
+    def __init__(self, ids: List[str], lens: List[int], postings: Dict[str, Tuple[List[int], List[int]]]):
+        self.ids = ids
+        self.lens = np.asarray(lens, dtype=np.float32)
+        self.postings = {t: (np.asarray(r, dtype=np.int32), np.asarray(f, dtype=np.float32)) for t, (r, f) in postings.items()}
+    def to_json(self) -> Dict:
+        return {"ids": self.ids, "lens": self.lens.astype(int).tolist(),
+                "postings": {t: [r.tolist(), f.astype(int).tolist()] for t, (r, f) in self.postings.items()}}
+class BM25Index:
+    """
+    Inverted index with BM25 scoring, sharded by document_id. Each shard is persisted as
+    `<path>/<document_id>.json` (rewritten atomically when the document gains chunks) and all shards
+    are loaded on first use. Corpus statistics (chunk count, average length, document frequency)
+    are global, so scores are comparable between document-scoped and unscoped searches.
+    Writers build and persist a shard without the index lock (adds to one document_id are
+    serialized by a per-document lock) and only take it to swap the shard in, so a large
+    document never stalls searches.
+    """
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._doc_locks: Dict[str, threading.Lock] = {}
+        self._shards: Dict[str, _Shard] = {}
+        self._df: Counter = Counter()
+        self._term_docs: Dict[str, set] = {}
+        self._rows = 0
+        self._total_len = 0.0
+        os.makedirs(path, exist_ok=True)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                self._attach(name[:-5], _Shard(raw["ids"], raw["lens"], {t: tuple(p) for t, p in raw["postings"].items()}))
+    def _attach(self, doc_id: str, shard: _Shard):
+        self._shards[doc_id] = shard
+        self._rows += len(shard.ids)
+        self._total_len += float(shard.lens.sum())
+        for t, (rows, _) in shard.postings.items():
+            self._df[t] += len(rows)
+            self._term_docs.setdefault(t, set()).add(doc_id)
+    def _detach(self, doc_id: str) -> Optional[_Shard]:
+        shard = self._shards.pop(doc_id, None)
+        if shard is not None:
+            self._rows -= len(shard.ids)
+            self._total_len -= float(shard.lens.sum())
+            for t, (rows, _) in shard.postings.items():
+                self._df[t] -= len(rows)
+                if self._df[t] <= 0:
+                    del self._df[t]
+                docs = self._term_docs.get(t)
+                docs.discard(doc_id)
+                if not docs:
+                    del self._term_docs[t]
+        return shard
+    def _shard_path(self, doc_id: str) -> str:
+        return os.path.join(self.path, f"{doc_id}.json")
+    def _doc_lock(self, doc_id: str) -> threading.Lock:
+        with self._lock:
+            return self._doc_locks.setdefault(doc_id, threading.Lock())
+    def has(self, doc_id: str) -> bool:
+        return str(doc_id) in self._shards
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict]) -> int:
+        """Index chunks by their metadata document_id; ids already indexed are skipped. Returns rows added."""
+        by_doc: Dict[str, List[int]] = {}
+        for i, md in enumerate(metadatas):
+            doc_id = (md or {}).get("document_id")
+            if doc_id is not None:
+                by_doc.setdefault(str(doc_id), []).append(i)
+        added = 0
+        for doc_id, idxs in by_doc.items():
+            with self._doc_lock(doc_id):
+                old = self._shards.get(doc_id)
+                ids_out = list(old.ids) if old else []
+                lens_out = old.lens.astype(int).tolist() if old else []
+                postings = {t: (r.tolist(), f.astype(int).tolist()) for t, (r, f) in old.postings.items()} if old else {}
+                have = set(ids_out)
+                for i in idxs:
+                    if ids[i] in have:
+                        continue
+                    have.add(ids[i])
+                    toks = tokenize(documents[i])
+                    row = len(ids_out)
+                    ids_out.append(ids[i])
+                    lens_out.append(len(toks))
+                    for t, n in Counter(toks).items():
+                        rows, tfs = postings.setdefault(t, ([], []))
+                        rows.append(row)
+                        tfs.append(n)
+                    added += 1
+                if old is not None and len(ids_out) == len(old.ids):
+                    continue
+                shard = _Shard(ids_out, lens_out, postings)
+                tmp = self._shard_path(doc_id) + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(shard.to_json(), f, separators=(",", ":"))
+                os.replace(tmp, self._shard_path(doc_id))
+                with self._lock:
+                    self._detach(doc_id)
+                    self._attach(doc_id, shard)
+        return added
+    def search(self, query: str, top_k: int, document_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        """[(chunk id, score)] best first; chunks sharing no term with the query are not returned."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._rows or not terms:
+                return []
+            avg = self._total_len / self._rows
+            idf = {t: math.log(1 + (self._rows - self._df[t] + 0.5) / (self._df[t] + 0.5)) for t in terms if t in self._df}
+            if document_id is not None:
+                doc_ids = [str(document_id)] if str(document_id) in self._shards else []
+            else:
+                doc_ids = set()
+                for t in idf:
+                    doc_ids |= self._term_docs.get(t, set())
+            out: List[Tuple[str, float]] = []
+            for doc_id in doc_ids:
+                shard = self._shards[doc_id]
+                scores = np.zeros(len(shard.ids), dtype=np.float32)
+                norm = self.k1 * (1 - self.b + self.b * shard.lens / avg)
+                for t, w in idf.items():
+                    p = shard.postings.get(t)
+                    if p is None:
+                        continue
+                    rows, tfs = p
+                    scores[rows] += w * tfs * (self.k1 + 1) / (tfs + norm[rows])
+                hit = np.flatnonzero(scores > 0)
+                if len(hit) > top_k:
+                    hit = hit[np.argpartition(-scores[hit], top_k - 1)[:top_k]]
+                out.extend((shard.ids[r], float(scores[r])) for r in hit)
+            out.sort(key=lambda x: -x[1])
+            return out[:top_k]
@@ -0,0 +1,98 @@
+import threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Hashable, Iterable, Optional, Set
+_MISS = object()
+class TTLCache:
+    """
+    Thread-safe in-process LRU with a per-entry TTL and hit/miss counters. Entries can carry
+    tags so a group of them can be dropped at once (e.g. everything for one document_id).
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    def _drop(self, key):
+        _, _, tags = self._data.pop(key)
+        for t in tags:
+            keys = self._tags.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[t]
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISS)
+            if item is not _MISS and item[0] < time.monotonic():
+                self._drop(key)
+                item = _MISS
+            if item is _MISS:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+    def set(self, key, value, tags: Iterable[str] = (), ttl: Optional[float] = None):
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, tags)
+            for t in tags:
+                self._tags.setdefault(t, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+    def invalidate_tag(self, tag: str):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"backend": "memory", "size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else None}
+class MongoCache:
+    """
+    Same interface as TTLCache, backed by a (sync pymongo) collection so several workers share
+    entries. Expired entries are filtered on read and reaped by a TTL index on expires_at; the
+    size bound is left to that index. Values must be BSON-serializable.
+    """
+    def __init__(self, uri: str, db: str, collection: str, ttl: float = 300.0):
+        from pymongo import MongoClient
+        self.ttl = ttl
+        self._col = MongoClient(uri)[db][collection]
+        self._col.create_index("expires_at", expireAfterSeconds=0)
+        self._col.create_index("tags")
+        self.hits = 0
+        self.misses = 0
+    def get(self, key, default=None):
+        doc = self._col.find_one({"_id": str(key), "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        if doc is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return doc["value"]
+    def set(self, key, value, tags: Iterable[str] = (), ttl: Optional[float] = None):
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.ttl if ttl is None else ttl)
+        self._col.replace_one({"_id": str(key)}, {"value": value, "tags": list(tags), "expires_at": expires}, upsert=True)
+    def invalidate(self, key):
+        self._col.delete_one({"_id": str(key)})
+    def invalidate_tag(self, tag: str):
+        self._col.delete_many({"tags": tag})
+    def clear(self):
+        self._col.delete_many({})
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"backend": "mongo", "size": self._col.estimated_document_count(), "hits": self.hits,
+                "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else None}
@@ -0,0 +1,102 @@
+import re, threading, time
+from typing import Dict, List, Tuple
+from app.core.config import settings
+from app.services.bm25_index import tokenize
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_ENC_RETRY_S = 300.0
+_enc = None
+_enc_failed_at: float | None = None
+_enc_lock = threading.Lock()
+_loader: threading.Thread | None = None
+def _load_encoding():
+    # tiktoken fetches its BPE file on first use (network, no timeout), so this only ever runs on
+    # the loader thread; a failure is retried after _ENC_RETRY_S instead of sticking for good
+    global _enc, _enc_failed_at
+    try:
+        import tiktoken
+        _enc = tiktoken.get_encoding(settings.context_tokenizer)
+    except Exception:
+        _enc_failed_at = time.monotonic()
+def warm_encoding():
+    """Start loading the tiktoken encoding in the background (called at startup)."""
+    global _loader
+    if _enc is not None or settings.context_tokenizer == "heuristic":
+        return
+    with _enc_lock:
+        if _loader is not None and _loader.is_alive():
+            return
+        if _enc_failed_at is not None and time.monotonic() - _enc_failed_at < _ENC_RETRY_S:
+            return
+        _loader = threading.Thread(target=_load_encoding, name="tiktoken-load", daemon=True)
+        _loader.start()
+def _encoding():
+    # never blocks the caller: until the encoding is loaded (offline, still downloading, or
+    # context_tokenizer="heuristic") we count ~4 chars per token, which over-counts slightly
+    if _enc is None:
+        warm_encoding()
+    return _enc
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+def _truncate(text: str, n: int) -> str:
+    enc = _encoding()
+    if enc is None:
+        return text[:n * 4]
+    return enc.decode(enc.encode(text, disallowed_special=())[:n])
+def budget_for(model: str | None) -> int:
+    """Prompt-context token budget for a model name (no provider prefix), else context_budget_tokens."""
+    return settings.context_budgets.get(model or "", settings.context_budget_tokens)
+def _window(text: str, query_terms: set, budget: int) -> str:
+    """Contiguous run of sentences around the one sharing most terms with the query, within budget."""
+    sents = [s for s in _SENTENCE.split(text) if s.strip()]
+    if not sents:
+        return ""
+    cost = [count_tokens(s) + 1 for s in sents]
+    best = max(range(len(sents)), key=lambda i: (len(query_terms.intersection(tokenize(sents[i]))), -i))
+    if cost[best] > budget:
+        return _truncate(sents[best], budget)
+    lo, hi, used = best, best + 1, cost[best]
+    while True:
+        # grow towards whichever neighbour still fits, preferring the following sentence
+        if hi < len(sents) and used + cost[hi] <= budget:
+            used += cost[hi]
+            hi += 1
+        elif lo > 0 and used + cost[lo - 1] <= budget:
+            lo -= 1
+            used += cost[lo]
+        else:
+            break
+    return " ".join(sents[lo:hi])
+def pack_context(hits: List[Dict], query: str = "", budget: int | None = None,
+                 per_hit_overhead: int = 4) -> Tuple[List[Dict], int]:
+    """
+    Fit ranked hits into `budget` prompt tokens. Hits are taken in order and kept whole while they
+    fit; a hit that does not fit is cut down to a sentence window around its best match for the
+    query. Packing stops when less than `context_min_window` tokens remain.
+    Returns (copies of the packed hits with "text" possibly trimmed, tokens used).
+    """
+    budget = settings.context_budget_tokens if budget is None else budget
+    terms = set(tokenize(query))
+    packed: List[Dict] = []
+    used = 0
+    for h in hits:
+        text = (h.get("text") or "").strip()
+        if not text:
+            continue
+        left = budget - used - per_hit_overhead
+        if left < settings.context_min_window:
+            break
+        n = count_tokens(text)
+        if n > left:
+            text = _window(text, terms, left)
+            if not text:
+                continue
+            n = count_tokens(text)
+            if n > left:  # joining sentences can tokenize a little differently
+                text = _truncate(text, left)
+                n = count_tokens(text)
+        packed.append(dict(h, text=text))
+        used += n + per_hit_overhead
+    return packed, used
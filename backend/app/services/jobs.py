@@ -0,0 +1,281 @@
+﻿import asyncio, hashlib, os, time
+from datetime import datetime
+from typing import Any, Dict, List
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.core.config import settings
+from app.core.db import get_db
+from app.ingestion.parsers import extract_pages, PARSE_TIMEOUT
+from app.ingestion.chunk import iter_chunks
+from app.services.vector_store import aadd_documents, get_embeddings, backfill_terms
+from app.services.summarize import build_summary_tree
+STAGES = ["parse", "chunk", "index", "commit", "summarize"]
+class QueueFull(Exception):
+    pass
+class StageError(Exception):
+    """A stage failure that retrying will not fix (e.g. no text in the file)."""
+_queue: asyncio.Queue | None = None
+_summary_queue: asyncio.Queue | None = None
+_workers: List[asyncio.Task] = []
+_reserved = 0  # queue slots promised to uploads whose job insert is still in flight
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=settings.ingest_queue_size)
+    return _queue
+def _get_summary_queue() -> asyncio.Queue:
+    global _summary_queue
+    if _summary_queue is None:
+        _summary_queue = asyncio.Queue(maxsize=settings.summary_queue_size)
+    return _summary_queue
+async def enqueue_ingest(storage_path: str, filename: str, content_type: str | None, size: int, sha256: str) -> Dict[str, Any]:
+    """Persist an ingest job and queue it. Raises QueueFull when the bounded queue is at capacity."""
+    global _reserved
+    q = _get_queue()
+    if q.maxsize and q.qsize() + _reserved >= q.maxsize:
+        raise QueueFull()
+    now = datetime.utcnow()
+    job = {
+        "_id": ObjectId(),
+        "type": "ingest",
+        "status": "queued",
+        "document_id": str(ObjectId()),  # reserved now, the documents record is written by the commit stage
+        "file": {"filename": filename, "content_type": content_type, "size": size,
+                 "sha256": sha256, "storage_path": storage_path},
+        "stages": {s: {"status": "pending", "attempts": 0} for s in STAGES},
+        "created_at": now,
+        "updated_at": now,
+    }
+    _reserved += 1
+    try:
+        await get_db().jobs.insert_one(job)
+    finally:
+        _reserved -= 1
+    try:
+        q.put_nowait(job["_id"])
+    except asyncio.QueueFull:
+        # a slot taken meanwhile by the startup resume; a job left "queued" here would never run
+        # and find_duplicate would keep handing it out for the same bytes
+        await get_db().jobs.delete_one({"_id": job["_id"]})
+        raise QueueFull()
+    return job
+async def find_duplicate(sha256: str) -> Dict[str, Any] | None:
+    """Upload response for content that is already indexed or queued, else None."""
+    db = get_db()
+    doc = await db.documents.find_one({"sha256": sha256}, {"_id": 1})
+    if doc:
+        return {"job_id": None, "document_id": str(doc["_id"]), "status": "done", "duplicate": True}
+    job = await db.jobs.find_one({"file.sha256": sha256, "status": {"$in": ["queued", "running"]}}, {"_id": 1, "document_id": 1, "status": 1})
+    if job:
+        return {"job_id": str(job["_id"]), "document_id": job["document_id"], "status": job["status"], "duplicate": True}
+    return None
+async def get_job(job_id: str) -> Dict[str, Any] | None:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await get_db().jobs.find_one({"_id": ObjectId(job_id)})
+def _iso(d):
+    return d.isoformat() if d else None
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    stages = {}
+    for name in STAGES:
+        st = (job.get("stages") or {}).get(name) or {}
+        stages[name] = {
+            "status": st.get("status"),
+            "attempts": st.get("attempts", 0),
+            "started_at": _iso(st.get("started_at")),
+            "finished_at": _iso(st.get("finished_at")),
+            "duration_ms": st.get("duration_ms"),
+            "error": st.get("error"),
+        }
+    return {
+        "id": str(job["_id"]),
+        "status": job.get("status"),
+        "document_id": job.get("document_id"),
+        "filename": (job.get("file") or {}).get("filename"),
+        "stages": stages,
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": _iso(job.get("created_at")),
+        "finished_at": _iso(job.get("finished_at")),
+    }
+# ---------- worker pool ----------
+async def _set(job_id, fields: Dict[str, Any]):
+    fields["updated_at"] = datetime.utcnow()
+    await get_db().jobs.update_one({"_id": job_id}, {"$set": fields})
+async def _run_stage(job_id, name: str, fn, *args):
+    retries = settings.ingest_stage_retries
+    for attempt in range(1, retries + 2):
+        started = datetime.utcnow()
+        t0 = time.perf_counter()
+        await _set(job_id, {f"stages.{name}.status": "running", f"stages.{name}.attempts": attempt,
+                            f"stages.{name}.started_at": started})
+        try:
+            out = await fn(*args)
+        except Exception as e:
+            final = isinstance(e, StageError) or attempt > retries
+            await _set(job_id, {f"stages.{name}.status": "failed" if final else "retrying",
+                                f"stages.{name}.error": str(e) or e.__class__.__name__,
+                                f"stages.{name}.duration_ms": round((time.perf_counter() - t0) * 1000, 1)})
+            if final:
+                raise
+            await asyncio.sleep(settings.ingest_retry_backoff_s * attempt)
+            continue
+        await _set(job_id, {f"stages.{name}.status": "done", f"stages.{name}.error": None,
+                            f"stages.{name}.finished_at": datetime.utcnow(),
+                            f"stages.{name}.duration_ms": round((time.perf_counter() - t0) * 1000, 1)})
+        return out
+async def _parse(f: Dict[str, Any]) -> List[str]:
+    pages = await extract_pages(f["storage_path"], f.get("content_type") or "")
+    if pages and pages[0].startswith(PARSE_TIMEOUT):
+        raise StageError(pages[0])  # would time out again; retrying only ties up parse workers
+    if pages and pages[0].startswith("[PARSE_ERROR]"):
+        raise RuntimeError(pages[0])
+    if not any(p.strip() for p in pages):
+        raise StageError("No text extracted")
+    return pages
+async def _chunk(pages: List[str]) -> List[Dict]:
+    # chunks straight from the page list, the full document text is never joined
+    return await asyncio.to_thread(lambda: list(iter_chunks(pages, sep="\n\n")))
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+def _first_occurrences(chunks: List[Dict]) -> Dict[str, int]:
+    # chunk hash -> index of its first occurrence in the document
+    first: Dict[str, int] = {}
+    for i, c in enumerate(chunks):
+        first.setdefault(_chunk_hash(c["text"]), i)
+    return first
+async def _index(doc_id: str, filename: str, chunks: List[Dict]) -> int:
+    """
+    Store this document's chunks, embedding each distinct chunk text once. Repeats inside the
+    document are dropped; text already indexed for another document reuses that vector instead of
+    being re-embedded (it still gets a row of its own so document-scoped search can find it).
+    Returns the number of rows stored.
+    """
+    db = get_db()
+    first = _first_occurrences(chunks)
+    known = {}
+    async for h in db.chunk_hashes.find({"_id": {"$in": list(first)}}):
+        known[h["_id"]] = h["vector_id"]
+    reused = await asyncio.to_thread(get_embeddings, list(known.values())) if known else {}
+    fresh, shared = [], []
+    for h, i in first.items():
+        (shared if known.get(h) in reused else fresh).append((h, i))
+    # ids are deterministic, so a retried or resumed index stage never duplicates vectors
+    for group, embeddings in ((fresh, None), (shared, [reused[known[h]] for h, _ in shared])):
+        if not group:
+            continue
+        ids = [f"{doc_id}:{i}" for _, i in group]
+        metadatas = [{"document_id": doc_id, "chunk_index": i, "filename": filename} for _, i in group]
+        docs = [chunks[i]["text"] for _, i in group]
+        await aadd_documents(ids, docs, metadatas, embeddings)
+    if fresh:
+        ops = [UpdateOne({"_id": h}, {"$setOnInsert": {"vector_id": f"{doc_id}:{i}", "document_id": doc_id}}, upsert=True)
+               for h, i in fresh]
+        await db.chunk_hashes.bulk_write(ops, ordered=False)
+    return len(first)
+async def _commit(job: Dict[str, Any], stored: int):
+    f = job["file"]
+    doc = {
+        "filename": f["filename"],
+        "filename_lc": " ".join(f["filename"].lower().split()),  # prefix search key
+        "ext": os.path.splitext(f["filename"])[1].lstrip(".").lower(),
+        "content_type": f.get("content_type"),
+        "size": f.get("size"),
+        "sha256": f.get("sha256"),
+        "storage_path": f["storage_path"],
+        "uploaded_at": datetime.utcnow(),
+        "chunk_count": stored,
+    }
+    await get_db().documents.replace_one({"_id": ObjectId(job["document_id"])}, doc, upsert=True)
+async def backfill_filename_lc():
+    # documents committed before filename_lc existed; idempotent, a no-op once they are all done
+    db = get_db()
+    ops = []
+    async for d in db.documents.find({"filename_lc": {"$exists": False}}, {"filename": 1}):
+        ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"filename_lc": " ".join((d.get("filename") or "").lower().split())}}))
+        if len(ops) >= 1000:
+            await db.documents.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.documents.bulk_write(ops, ordered=False)
+async def backfill_bm25():
+    # chunks indexed before the BM25 index existed; re-uploads are short-circuited by the sha256
+    # dedup, so without this those documents would never get postings
+    if not settings.bm25_enabled:
+        return
+    async for d in get_db().documents.find({}, {"chunk_count": 1}):
+        try:
+            await asyncio.to_thread(backfill_terms, str(d["_id"]), d.get("chunk_count") or 100000)
+        except Exception:
+            pass  # vector store unreachable; retried on the next startup
+async def _summarize(doc_id: str, chunks: List[Dict]):
+    # the same chunks that were indexed (in-document repeats add nothing to a summary)
+    tree = await build_summary_tree([chunks[i] for i in sorted(_first_occurrences(chunks).values())])
+    await get_db().documents.update_one({"_id": ObjectId(doc_id)}, {"$set": {"summary_tree": tree}})
+async def _run_job(job_id):
+    job = await get_db().jobs.find_one({"_id": job_id})
+    if not job or job.get("status") not in ("queued", "running"):
+        return
+    await _set(job_id, {"status": "running"})
+    try:
+        pages = await _run_stage(job_id, "parse", _parse, job["file"])
+        chunks = await _run_stage(job_id, "chunk", _chunk, pages)
+        stored = await _run_stage(job_id, "index", _index, job["document_id"], job["file"]["filename"], chunks)
+        await _run_stage(job_id, "commit", _commit, job, stored)
+    except Exception as e:
+        await _set(job_id, {"status": "failed", "error": str(e) or e.__class__.__name__, "finished_at": datetime.utcnow()})
+        return
+    # the document is searchable from here on; a missing summary tree only means summarize
+    # falls back to answering from the chunks, so the (long, LLM-bound) summary is built by the
+    # summary workers and neither fails the job nor holds an ingest worker
+    summary = {"stages.summarize.status": "skipped"}
+    if settings.summary_enabled:
+        try:
+            _get_summary_queue().put_nowait((job_id, job["document_id"], chunks))
+            summary = {"stages.summarize.status": "queued"}
+        except asyncio.QueueFull:
+            summary["stages.summarize.error"] = "summary queue full"
+    await _set(job_id, {"status": "done", "result": {"document_id": job["document_id"], "chunks": stored},
+                        "finished_at": datetime.utcnow(), **summary})
+async def _worker(q: asyncio.Queue):
+    while True:
+        job_id = await q.get()
+        try:
+            await _run_job(job_id)
+        except Exception:
+            pass  # _run_job records stage failures; a Mongo outage here leaves the job to be resumed at startup
+        finally:
+            q.task_done()
+async def _summary_worker(q: asyncio.Queue):
+    while True:
+        job_id, doc_id, chunks = await q.get()
+        try:
+            await _run_stage(job_id, "summarize", _summarize, doc_id, chunks)
+        except Exception:
+            pass  # recorded on the stage
+        finally:
+            q.task_done()
+async def _resume_pending(q: asyncio.Queue, before: datetime):
+    # jobs interrupted by a restart are re-run from the top; every stage is idempotent
+    cur = get_db().jobs.find({"status": {"$in": ["queued", "running"]}, "created_at": {"$lt": before}}, {"_id": 1})
+    async for job in cur.sort("created_at", 1):
+        await q.put(job["_id"])
+async def start_workers():
+    q = _get_queue()
+    _workers.append(asyncio.create_task(backfill_filename_lc()))
+    _workers.append(asyncio.create_task(backfill_bm25()))
+    for _ in range(max(1, settings.ingest_workers)):
+        _workers.append(asyncio.create_task(_worker(q)))
+    # queued summaries live in memory only; ones cut short by a restart are not rebuilt
+    await get_db().jobs.update_many({"stages.summarize.status": {"$in": ["queued", "running", "retrying"]}},
+                                    {"$set": {"stages.summarize.status": "skipped",
+                                              "stages.summarize.error": "interrupted by restart"}})
+    sq = _get_summary_queue()
+    for _ in range(max(1, settings.summary_workers)):
+        _workers.append(asyncio.create_task(_summary_worker(sq)))
+    _workers.append(asyncio.create_task(_resume_pending(q, datetime.utcnow())))
+async def stop_workers():
+    for t in _workers:
+        t.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -1,9 +1,13 @@
 ﻿from typing import List, Dict, Tuple, AsyncGenerator
 from app.core.config import settings
+from app.services.llm_providers import get_openai, get_ollama
+from app.services.context import pack_context, budget_for
 import asyncio
 
-def _format_context(hits: List[Dict]) -> str:
-    return "\n\n".join([(h.get("text") or "")[:1000] for h in hits if h.get("text")])
+def _format_context(hits: List[Dict], query: str = "", model: str | None = None) -> str:
+    # ranked hits packed into the model's prompt-token budget (see services.context)
+    packed, _ = pack_context(hits, query, budget_for(model))
+    return "\n\n".join(h["text"] for h in packed)
 def _used_sources(hits: List[Dict]) -> List[Dict]:
     out = []
     for h in hits:
@@ -18,7 +22,7 @@ def answer_with_context(query: str, hits: List[Dict]) -> Tuple[str, List[Dict]]:
     """
     Non-streaming answer. Uses OpenAI if OPENAI_API_KEY present; otherwise returns a simple fallback.
     """
-    context = _format_context(hits)
+    context = _format_context(hits, query, "gpt-4o-mini")
     used = _used_sources(hits)
     openai_key = getattr(settings, "openai_api_key", None)
    
@@ -32,8 +36,8 @@ def answer_with_context(query: str, hits: List[Dict]) -> Tuple[str, List[Dict]]:
         return answer, used
     
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=openai_key)
+        # pooled client: keeps the connection (and TLS session) instead of a new one per answer
+        client = get_openai("gpt-4o-mini", api_key=openai_key).client
         prompt = (
             "Return PLAIN TEXT only (no markdown). "
             "Use simple sections if helpful:\n"
@@ -55,99 +59,143 @@ async def stream_answer(query: str, hits: List[Dict]) -> AsyncGenerator[str, Non
     """
     Streaming answer as an async generator of small text chunks.
     Tries OpenAI streaming if key is set; if not, tries Ollama if configured; else falls back.
+    All provider I/O goes through the pooled async clients, so nothing here blocks the event loop.
     """
-    context = _format_context(hits)
     openai_key = getattr(settings, "openai_api_key", None)
    
     if openai_key:
+        started = False
+        context = _format_context(hits, query, "gpt-4o-mini")
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=openai_key)
-            stream = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{
-                    "role": "user",
-                    "content": (
-                        "Return PLAIN TEXT only (no markdown). "
-                        "Use simple section labels if helpful:\n"
-                        "Summary:\nResources:\nTopics:\nPeople:\nActions:\nOne-line takeaway:\n"
-                        "Use '- ' for bullets. No emojis.\n\n"
-                        f"Context:\n{context}\n\nQuestion: {query}"
-                    )
-                }],
-                temperature=0.2,
-                stream=True,
+            prompt = (
+                "Return PLAIN TEXT only (no markdown). "
+                "Use simple section labels if helpful:\n"
+                "Summary:\nResources:\nTopics:\nPeople:\nActions:\nOne-line takeaway:\n"
+                "Use '- ' for bullets. No emojis.\n\n"
+                f"Context:\n{context}\n\nQuestion: {query}"
             )
-            for chunk in stream:
-                piece = ""
-                try:
-                    piece = chunk.choices[0].delta.content or ""
-                except Exception:
-                    piece = ""
-                if piece:
-                    yield piece
+            async for piece in get_openai("gpt-4o-mini", api_key=openai_key).astream(prompt):
+                started = True
+                yield piece
             return
         except Exception:
-            pass 
+            if started:
+                raise
     
     provider = str(getattr(settings, "llm_provider", "openai")).lower()
     if provider == "ollama":
-        import json, requests
         base = getattr(settings, "ollama_base_url", "http://127.0.0.1:11434")
         model = getattr(settings, "ollama_model", "llama3.1")
+        started = False
+        context = _format_context(hits, query, model)
         try:
-            url = f"{base}/api/chat"
-            payload = {
-                "model": model,
-                "stream": True,
-                "messages": [
-                    {"role": "system", "content":
-                        "Return PLAIN TEXT only. Avoid markdown symbols. Use simple bullets '- ' if needed."
-                    },
-                    {"role": "user", "content":
-                        f"CONTEXT:\n{context}\n\nTASK: {query}"
-                    }
-                ]
-            }
-            with requests.post(url, json=payload, stream=True, timeout=300) as r:
-                r.raise_for_status()
-                for line in r.iter_lines(decode_unicode=True):
-                    if not line:
-                        await asyncio.sleep(0)
-                        continue
-                    
-                    try:
-                        obj = json.loads(line)
-                    except Exception:
-                        continue
-                    msg = (obj.get("message") or {}).get("content") or obj.get("response") or ""
-                    if msg:
-                        yield msg
+            ol = get_ollama(model, url=base)
+            async for piece in ol.astream(
+                f"CONTEXT:\n{context}\n\nTASK: {query}",
+                system="Return PLAIN TEXT only. Avoid markdown symbols. Use simple bullets '- ' if needed.",
+                timeout=300,
+            ):
+                started = True
+                yield piece
             return
         except Exception:
-            pass 
+            if started:
+                raise
    
-    ans, _ = answer_with_context(query, hits)
+    ans, _ = await asyncio.to_thread(answer_with_context, query, hits)
     for i in range(0, len(ans), 64):
         yield ans[i:i+64]
         await asyncio.sleep(0)
 
 import os
-from app.services.llm_providers import OpenAIProvider, OllamaProvider
-def complete_with_fallback(prompt: str, system: str | None = None, model: str | None = None) -> str:
-    """
-    Try OpenAI first (if key present) and cleanly fall back to Ollama on 429 (insufficient_quota)
-    or when OPENAI_API_KEY is absent. Never returns provider error text.
-    """
-    use_openai = os.getenv("LLM_PRIMARY", "openai") == "openai" and os.getenv("OPENAI_API_KEY")
+from app.services.answer_cache import AnswerCache, fingerprint
+_answer_cache = None
+def _get_answer_cache() -> AnswerCache | None:
+    global _answer_cache
+    if _answer_cache is None and settings.answer_cache_enabled:
+        _answer_cache = AnswerCache(settings.answer_cache_path, settings.answer_cache_ttl_s,
+                                    settings.answer_cache_max_entries)
+    return _answer_cache
+def answer_cache_stats() -> Dict:
+    cache = _get_answer_cache()
+    return cache.stats() if cache else {"backend": "off"}
+def _is_quota_error(e: Exception) -> bool:
+    msg = str(e)
+    return ("429" in msg) or ("insufficient_quota" in msg)
+# the uncached calls return (answer, "provider:model" that actually produced it)
+def _complete_uncached(use_openai, prompt: str, system: str | None, model: str | None) -> Tuple[str, str]:
     if use_openai:
+        name = os.getenv("OPENAI_MODEL") or model or "o4-mini"
         try:
-            return OpenAIProvider(model=os.getenv("OPENAI_MODEL") or model or "o4-mini").complete(prompt, system=system)
+            return get_openai(name).complete(prompt, system=system), f"openai:{name}"
         except Exception as e:
-            msg = str(e)
-            is_quota = ("429" in msg) or ("insufficient_quota" in msg)
-            if not is_quota:
-                
+            if not _is_quota_error(e):
                 raise
-           
-    return OllamaProvider(model=os.getenv("LLM_MODEL") or model or "llama3.1:8b").complete(prompt, system=system)
+    name = os.getenv("LLM_MODEL") or model or "llama3.1:8b"
+    return get_ollama(name).complete(prompt, system=system), f"ollama:{name}"
+async def _acomplete_uncached(use_openai, prompt: str, system: str | None, model: str | None) -> Tuple[str, str]:
+    if use_openai:
+        name = os.getenv("OPENAI_MODEL") or model or "o4-mini"
+        try:
+            return await get_openai(name).acomplete(prompt, system=system), f"openai:{name}"
+        except Exception as e:
+            if not _is_quota_error(e):
+                raise
+    name = os.getenv("LLM_MODEL") or model or "llama3.1:8b"
+    return await get_ollama(name).acomplete(prompt, system=system), f"ollama:{name}"
+def _primary(model: str | None):
+    use_openai = os.getenv("LLM_PRIMARY", "openai") == "openai" and os.getenv("OPENAI_API_KEY")
+    if use_openai:
+        return use_openai, "openai", os.getenv("OPENAI_MODEL") or model or "o4-mini"
+    return use_openai, "ollama", os.getenv("LLM_MODEL") or model or "llama3.1:8b"
+def primary_model(model: str | None = None) -> str:
+    """Model complete_with_fallback will try first (without the provider prefix)."""
+    return _primary(model)[2]
+def _cache_keys(model_label: str, system: str | None, prompt: str, semantic_key: str | None) -> List[str]:
+    keys = [fingerprint(model_label, system, prompt)]
+    if semantic_key:
+        keys.append(fingerprint(model_label, system, "semantic", semantic_key))
+    return keys
+def _cache_plan(prompt: str, system: str | None, model: str | None, use_cache: bool, semantic_key: str | None):
+    use_openai, provider, name = _primary(model)
+    primary = f"{provider}:{name}"
+    return use_openai, primary, (_get_answer_cache() if use_cache else None), _cache_keys(primary, system, prompt, semantic_key)
+def _store(cache: AnswerCache, keys: List[str], primary: str, answered_by: str, answer: str,
+           system: str | None, prompt: str, semantic_key: str | None):
+    # a fallback answer is filed under the model that wrote it, never under the primary's keys
+    if answered_by != primary:
+        keys = _cache_keys(answered_by, system, prompt, semantic_key)
+    for k in keys:
+        cache.put(k, answer, answered_by)
+def complete_with_fallback(prompt: str, system: str | None = None, model: str | None = None,
+                           use_cache: bool = True, semantic_key: str | None = None) -> str:
+    """
+    Try OpenAI first (if key present) and cleanly fall back to Ollama on 429 (insufficient_quota)
+    or when OPENAI_API_KEY is absent. Never returns provider error text.
+    Answers are cached by a fingerprint of model + system + prompt; callers may pass a
+    `semantic_key` (e.g. retrieved chunk ids + normalized question) as a second lookup key.
+    """
+    use_openai, primary, cache, keys = _cache_plan(prompt, system, model, use_cache, semantic_key)
+    if cache:
+        hit = cache.get(*keys)
+        if hit is not None:
+            return hit
+    ans, answered_by = _complete_uncached(use_openai, prompt, system, model)
+    if cache and ans:
+        _store(cache, keys, primary, answered_by, ans, system, prompt, semantic_key)
+    return ans
+async def acomplete_with_fallback(prompt: str, system: str | None = None, model: str | None = None,
+                                  use_cache: bool = True, semantic_key: str | None = None) -> str:
+    """
+    complete_with_fallback on the pooled async provider clients. The answer cache is SQLite (its
+    busy timeout can block for seconds under contention), so it is only touched from a thread.
+    """
+    use_openai, primary, cache, keys = _cache_plan(prompt, system, model, use_cache, semantic_key)
+    if cache:
+        hit = await asyncio.to_thread(cache.get, *keys)
+        if hit is not None:
+            return hit
+    ans, answered_by = await _acomplete_uncached(use_openai, prompt, system, model)
+    if cache and ans:
+        await asyncio.to_thread(_store, cache, keys, primary, answered_by, ans, system, prompt, semantic_key)
+    return ans
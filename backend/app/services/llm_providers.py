@@ -1,11 +1,66 @@
 
-import os, json, requests
+import os, json, threading
+from collections import OrderedDict
+import httpx
+from app.core.config import settings
+
+# One pooled HTTP client per process (per kind), shared by every provider instance, so completions
+# reuse keep-alive connections instead of opening a TCP connection per call. Providers own no
+# connections, so the registry (keyed partly on request-supplied model names) can simply be an
+# LRU bounded by llm_provider_cache_size.
+_http: httpx.Client | None = None
+_ahttp: httpx.AsyncClient | None = None
+_providers: "OrderedDict[tuple, object]" = OrderedDict()
+_lock = threading.RLock()  # re-entered: providers pick up the shared clients while registered
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=settings.llm_pool_max_connections,
+                        max_keepalive_connections=settings.llm_pool_max_keepalive,
+                        keepalive_expiry=settings.llm_keepalive_expiry_s)
+def _sync_http() -> httpx.Client:
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                _http = httpx.Client(limits=_limits(), timeout=settings.llm_timeout_s)
+    return _http
+def _async_http() -> httpx.AsyncClient:
+    global _ahttp
+    if _ahttp is None:
+        _ahttp = httpx.AsyncClient(limits=_limits(), timeout=settings.llm_timeout_s)
+    return _ahttp
+def get_ollama(model=None, url=None) -> "OllamaProvider":
+    return _singleton(OllamaProvider, url=url or os.getenv("OLLAMA_URL", "http://127.0.0.1:11434"),
+                      model=model or os.getenv("LLM_MODEL", "llama3.1:8b"))
+def get_openai(model=None, api_key=None) -> "OpenAIProvider":
+    return _singleton(OpenAIProvider, model=model or os.getenv("OPENAI_MODEL", "o4-mini"),
+                      api_key=api_key or os.getenv("OPENAI_API_KEY"))
+def _singleton(cls, **kw):
+    key = (cls.__name__,) + tuple(sorted(kw.items()))
+    with _lock:
+        p = _providers.get(key)
+        if p is None:
+            p = _providers[key] = cls(**kw)
+            while len(_providers) > max(1, settings.llm_provider_cache_size):
+                _providers.popitem(last=False)
+        else:
+            _providers.move_to_end(key)
+    return p
+async def aclose_providers():
+    global _http, _ahttp
+    http, ahttp, _http, _ahttp = _http, _ahttp, None, None
+    for p in list(_providers.values()):
+        await p.aclose()
+    _providers.clear()
+    if ahttp is not None:
+        await ahttp.aclose()
+    if http is not None:
+        http.close()
 
 class OllamaProvider:
     def __init__(self, url=None, model=None):
         self.url = url or os.getenv("OLLAMA_URL", "http://127.0.0.1:11434")
         self.model = model or os.getenv("LLM_MODEL", "llama3.1:8b")
-        
+
         self.use_generate = str(os.getenv("OLLAMA_USE_GENERATE", "")).lower() in ("1","true","yes")
     def _compose_prompt(self, messages):
         sys = next((m["content"] for m in messages if m.get("role") == "system"), None)
@@ -14,85 +69,110 @@ class OllamaProvider:
         if sys: prompt += sys.strip() + "\n\n"
         prompt += "\n\n".join(u.strip() for u in users)
         return prompt
-    def stream(self, prompt, system=None, timeout=120):
+    def _messages(self, prompt, system=None):
         msgs = []
         if system:
             msgs.append({"role": "system", "content": system})
         msgs.append({"role": "user", "content": prompt})
+        return msgs
+    def _request(self, msgs, stream):
+        # (url, payload, extractor) for the chat API, or for /api/generate on older servers
         if not self.use_generate:
-            r = requests.post(
-                f"{self.url}/api/chat",
-                json={"model": self.model, "messages": msgs, "stream": True},
-                stream=True, timeout=timeout,
-            )
-            if r.status_code == 404:
-                self.use_generate = True  
-            else:
+            return (f"{self.url}/api/chat", {"model": self.model, "messages": msgs, "stream": stream},
+                    lambda data: (data.get("message") or {}).get("content", ""))
+        return (f"{self.url}/api/generate", {"model": self.model, "prompt": self._compose_prompt(msgs), "stream": stream},
+                lambda data: data.get("response", ""))
+    def stream(self, prompt, system=None, timeout=120):
+        msgs = self._messages(prompt, system)
+        for _ in range(2):
+            url, payload, extract = self._request(msgs, True)
+            with _sync_http().stream("POST", url, json=payload, timeout=timeout) as r:
+                if r.status_code == 404 and not self.use_generate:
+                    self.use_generate = True
+                    continue
                 r.raise_for_status()
-                for line in r.iter_lines(decode_unicode=True):
+                for line in r.iter_lines():
                     if not line: continue
-                    data = json.loads(line)
-                    delta = (data.get("message") or {}).get("content", "")
+                    delta = extract(json.loads(line))
                     if delta: yield delta
                 return
-        
-        gen_prompt = self._compose_prompt(msgs)
-        r = requests.post(
-            f"{self.url}/api/generate",
-            json={"model": self.model, "prompt": gen_prompt, "stream": True},
-            stream=True, timeout=timeout,
-        )
-        r.raise_for_status()
-        for line in r.iter_lines(decode_unicode=True):
-            if not line: continue
-            data = json.loads(line)
-            delta = data.get("response", "")
-            if delta: yield delta
     def complete(self, prompt, system=None, timeout=120):
-        msgs = []
-        if system:
-            msgs.append({"role": "system", "content": system})
-        msgs.append({"role": "user", "content": prompt})
-        if not self.use_generate:
-            r = requests.post(
-                f"{self.url}/api/chat",
-                json={"model": self.model, "messages": msgs, "stream": False},
-                timeout=timeout,
-            )
-            if r.status_code == 404:
+        msgs = self._messages(prompt, system)
+        for _ in range(2):
+            url, payload, extract = self._request(msgs, False)
+            r = _sync_http().post(url, json=payload, timeout=timeout)
+            if r.status_code == 404 and not self.use_generate:
                 self.use_generate = True
-            else:
+                continue
+            r.raise_for_status()
+            return extract(r.json())
+    async def astream(self, prompt, system=None, timeout=120):
+        msgs = self._messages(prompt, system)
+        for _ in range(2):
+            url, payload, extract = self._request(msgs, True)
+            async with _async_http().stream("POST", url, json=payload, timeout=timeout) as r:
+                if r.status_code == 404 and not self.use_generate:
+                    self.use_generate = True
+                    continue
                 r.raise_for_status()
-                data = r.json()
-                return (data.get("message") or {}).get("content", "")
-       
-        gen_prompt = self._compose_prompt(msgs)
-        r = requests.post(
-            f"{self.url}/api/generate",
-            json={"model": self.model, "prompt": gen_prompt, "stream": False},
-            timeout=timeout,
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data.get("response", "")
+                async for line in r.aiter_lines():
+                    if not line: continue
+                    delta = extract(json.loads(line))
+                    if delta: yield delta
+                return
+    async def acomplete(self, prompt, system=None, timeout=120):
+        msgs = self._messages(prompt, system)
+        for _ in range(2):
+            url, payload, extract = self._request(msgs, False)
+            r = await _async_http().post(url, json=payload, timeout=timeout)
+            if r.status_code == 404 and not self.use_generate:
+                self.use_generate = True
+                continue
+            r.raise_for_status()
+            return extract(r.json())
+    async def aclose(self):
+        pass  # connections belong to the shared module-level clients
 
 class OpenAIProvider:
-    def __init__(self, model=None):
+    def __init__(self, model=None, api_key=None):
         self.model = model or os.getenv("OPENAI_MODEL", "o4-mini")
-        from openai import OpenAI  
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    def complete(self, prompt, system=None):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        from openai import OpenAI, AsyncOpenAI
+        self.client = OpenAI(api_key=api_key, http_client=_sync_http())
+        self.aclient = AsyncOpenAI(api_key=api_key, http_client=_async_http())
+    def _input(self, prompt, system=None):
         if system:
-            input_payload = [
+            return [
                 {"role": "system", "content": [{"type":"text","text": system}]},
                 {"role": "user",   "content": [{"type":"text","text": prompt}]},
             ]
-        else:
-            input_payload = prompt
-        resp = self.client.responses.create(model=self.model, input=input_payload)
+        return prompt
+    @staticmethod
+    def _output_text(resp):
         parts = getattr(resp, "output", []) or []
         for p in parts:
             for c in getattr(p, "content", []) or []:
                 if getattr(c, "type", "") == "output_text":
                     return c.text
         return getattr(resp, "output_text", "")
+    def complete(self, prompt, system=None):
+        resp = self.client.responses.create(model=self.model, input=self._input(prompt, system))
+        return self._output_text(resp)
+    async def acomplete(self, prompt, system=None):
+        resp = await self.aclient.responses.create(model=self.model, input=self._input(prompt, system))
+        return self._output_text(resp)
+    async def astream(self, prompt, system=None):
+        msgs = []
+        if system:
+            msgs.append({"role": "system", "content": system})
+        msgs.append({"role": "user", "content": prompt})
+        stream = await self.aclient.chat.completions.create(model=self.model, messages=msgs, stream=True)
+        try:
+            async for chunk in stream:
+                piece = chunk.choices[0].delta.content if chunk.choices else None
+                if piece:
+                    yield piece
+        finally:
+            await stream.close()  # on cancellation too, so the upstream generation is abandoned
+    async def aclose(self):
+        pass  # the SDK clients wrap the shared module-level connection pools
@@ -0,0 +1,266 @@
+import os, json, threading
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+class LocalVectorIndex:
+    """
+    In-process vector index over memory-mapped float32 segment files.
+
+    Layout under `path`: seg_00000.f32 (raw row-major float32, `dim` floats per row) next to
+    seg_00000.jsonl (one {"id","document","metadata"} line per row). Segments hold at most
+    `segment_rows` rows, so global row r lives in segment r // segment_rows. Vectors are expected
+    to be L2-normalized, which makes inner-product ranking identical to Chroma's l2 ranking.
+
+    Search is brute force until the index reaches `ivf_threshold` rows, after which an IVF
+    (spherical k-means coarse quantizer) is trained and only `ivf_nprobe` lists are scanned.
+    Training runs on a background thread (again whenever the index doubles) and the new
+    quantizer is swapped in when done, so queries and writes never wait on k-means.
+    Per-document_id postings turn document-scoped queries into a direct row lookup.
+    """
+    def __init__(self, path: str, dim: int, segment_rows: int = 65536, ivf_threshold: int = 50000,
+                 ivf_lists: int = 0, ivf_nprobe: int = 8):
+        self.path = path
+        self.dim = dim
+        self.segment_rows = segment_rows
+        self.ivf_threshold = ivf_threshold
+        self.ivf_lists = ivf_lists
+        self.ivf_nprobe = ivf_nprobe
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._segments: List[np.memmap] = []
+        self._offsets: List[int] = []          # row -> byte offset of its line in the segment's jsonl
+        self._ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._ivf_rows = 0
+        self._training: Optional[threading.Thread] = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+        with self._lock:
+            self._maybe_train()
+    # ---------- storage ----------
+    def _seg_path(self, seg: int, ext: str) -> str:
+        return os.path.join(self.path, f"seg_{seg:05d}.{ext}")
+    def _map_segment(self, seg: int, rows: int):
+        m = np.memmap(self._seg_path(seg, "f32"), dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else \
+            np.zeros((0, self.dim), dtype=np.float32)
+        if seg < len(self._segments):
+            self._segments[seg] = m
+        else:
+            self._segments.append(m)
+    def _load(self):
+        seg = 0
+        while os.path.exists(self._seg_path(seg, "jsonl")):
+            rows = end = 0
+            with open(self._seg_path(seg, "jsonl"), "rb") as f:
+                while True:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # torn write; the row was never acknowledged
+                    rec = json.loads(line)
+                    self._register(rec["id"], (rec.get("metadata") or {}).get("document_id"), end)
+                    end += len(line)
+                    rows += 1
+            # drop any vector rows / partial line written after the last complete record
+            vec_path = self._seg_path(seg, "f32")
+            if os.path.exists(vec_path) and os.path.getsize(vec_path) > rows * self.dim * 4:
+                with open(vec_path, "r+b") as f:
+                    f.truncate(rows * self.dim * 4)
+            with open(self._seg_path(seg, "jsonl"), "r+b") as f:
+                f.truncate(end)
+            self._map_segment(seg, rows)
+            seg += 1
+    def _read_line(self, seg: int, off: int) -> bytes:
+        with open(self._seg_path(seg, "jsonl"), "rb") as f:
+            f.seek(off)
+            return f.readline()
+    def _register(self, id_: str, document_id: Optional[str], off: int):
+        row = len(self._ids)
+        self._ids.append(id_)
+        self._offsets.append(off)
+        self._id_to_row[id_] = row
+        if document_id is not None:
+            self._postings.setdefault(str(document_id), []).append(row)
+    def _record(self, row: int, vec: Optional[np.ndarray] = None) -> Dict:
+        rec = json.loads(self._read_line(row // self.segment_rows, self._offsets[row]))
+        hit = {"id": rec["id"], "text": rec.get("document"), "metadata": rec.get("metadata") or {}}
+        if vec is not None:
+            hit["embedding"] = vec
+        return hit
+    def _records(self, rows: List[int], segments: List[np.memmap], with_embeddings: bool) -> List[Dict]:
+        if not with_embeddings:
+            return [self._record(row) for row in rows]
+        vecs = self._vectors(np.asarray(rows, dtype=np.int64), segments)
+        return [self._record(row, vecs[k]) for k, row in enumerate(rows)]
+    def _vectors(self, rows: np.ndarray, segments: Optional[List[np.memmap]] = None) -> np.ndarray:
+        segments = self._segments if segments is None else segments
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        segs = rows // self.segment_rows
+        for seg in np.unique(segs):
+            mask = segs == seg
+            out[mask] = segments[seg][rows[mask] % self.segment_rows]
+        return out
+    @property
+    def count(self) -> int:
+        return len(self._ids)
+    # ---------- writes ----------
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict], embeddings) -> int:
+        """Append rows; ids that already exist are skipped (same as Chroma's add). Returns rows written."""
+        vecs = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), self.dim))
+        with self._write_lock:
+            # writers are serialized here; the index lock is only taken to publish, so queries keep
+            # running against the already-published rows while the segment files are appended to
+            with self._lock:
+                start = self.count
+                keep, seen = [], set()
+                for i, id_ in enumerate(ids):
+                    if id_ not in self._id_to_row and id_ not in seen:
+                        seen.add(id_)
+                        keep.append(i)
+            sizes: List[Tuple[int, int, int]] = []  # (seg, f32 size, jsonl size) before this add
+            try:
+                parts, pos = [], 0
+                while pos < len(keep):
+                    seg, used = divmod(start + pos, self.segment_rows)
+                    part = keep[pos:pos + self.segment_rows - used]
+                    sizes.append((seg, self._size(seg, "f32"), self._size(seg, "jsonl")))
+                    with open(self._seg_path(seg, "f32"), "ab") as f:
+                        f.write(vecs[part].tobytes())
+                    offs = []
+                    with open(self._seg_path(seg, "jsonl"), "ab") as f:
+                        for i in part:
+                            offs.append(f.tell())
+                            f.write(json.dumps({"id": ids[i], "document": documents[i], "metadata": metadatas[i]},
+                                               ensure_ascii=False).encode("utf-8") + b"\n")
+                    parts.append((seg, used, part, offs))
+                    pos += len(part)
+                with self._lock:
+                    for seg, used, part, offs in parts:
+                        for i, off in zip(part, offs):
+                            self._register(ids[i], (metadatas[i] or {}).get("document_id"), off)
+                        self._map_segment(seg, used + len(part))
+                    if self._centroids is not None and keep:
+                        new_rows = np.arange(start, self.count)
+                        for row, lst in zip(new_rows, self._assign(self._vectors(new_rows))):
+                            self._lists[lst].append(int(row))
+                    self._maybe_train()
+            except BaseException:
+                self._rollback(start, sizes)
+                raise
+            return len(keep)
+    def _size(self, seg: int, ext: str) -> int:
+        path = self._seg_path(seg, ext)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    def _rollback(self, start: int, sizes: List[Tuple[int, int, int]]):
+        # undo a failed add: unpublish its rows and cut both files back, so the next add appends
+        # at the offsets the registered rows expect instead of after a half-written batch
+        with self._lock:
+            for id_ in self._ids[start:]:
+                self._id_to_row.pop(id_, None)
+            for rows in self._postings.values():
+                while rows and rows[-1] >= start:
+                    rows.pop()
+            for lst in self._lists:
+                while lst and lst[-1] >= start:
+                    lst.pop()
+            del self._ids[start:], self._offsets[start:]
+            for seg, f32_size, jsonl_size in sizes:
+                for ext, size in (("f32", f32_size), ("jsonl", jsonl_size)):
+                    if os.path.exists(self._seg_path(seg, ext)):
+                        with open(self._seg_path(seg, ext), "r+b") as f:
+                            f.truncate(size)
+                self._map_segment(seg, f32_size // (self.dim * 4))
+    # ---------- IVF ----------
+    def _assign(self, vecs: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        return np.argmax(vecs @ (self._centroids if centroids is None else centroids).T, axis=1)
+    def _maybe_train(self):
+        # caller holds the lock
+        if self.count < self.ivf_threshold or (self._training and self._training.is_alive()):
+            return
+        if self._centroids is None or self.count > 2 * self._ivf_rows:
+            self._training = threading.Thread(target=self._train_ivf, name="ivf-train", daemon=True)
+            self._training.start()
+    def wait_for_training(self, timeout: float | None = None):
+        t = self._training
+        if t is not None:
+            t.join(timeout)
+    def _train_ivf(self):
+        # k-means over a snapshot of the rows present now, outside the lock; segments are
+        # append-only and replaced (never mutated) on growth, so the snapshot stays readable
+        with self._lock:
+            n, segments = self.count, list(self._segments)
+        nlist = min(n, self.ivf_lists or max(16, int(np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample = self._vectors(np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False)), segments)
+        cent = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(10):
+            assign = np.argmax(sample @ cent.T, axis=1)
+            sums = np.zeros_like(cent)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            cent = np.where(empty[:, None], cent, sums / np.where(norms == 0, 1.0, norms))
+        cent = cent.astype(np.float32)
+        lists: List[List[int]] = [[] for _ in range(nlist)]
+        for lo in range(0, n, self.segment_rows):
+            rows = np.arange(lo, min(n, lo + self.segment_rows))
+            for row, lst in zip(rows, self._assign(self._vectors(rows, segments), cent)):
+                lists[lst].append(int(row))
+        with self._lock:
+            # rows written while training get assigned here, then the new quantizer goes live
+            new_rows = np.arange(n, self.count)
+            if len(new_rows):
+                for row, lst in zip(new_rows, self._assign(self._vectors(new_rows), cent)):
+                    lists[lst].append(int(row))
+            self._centroids, self._lists, self._ivf_rows = cent, lists, n
+    def _candidate_rows(self, qvec: np.ndarray) -> Optional[np.ndarray]:
+        # brute force until the first quantizer has been trained
+        if self.count < self.ivf_threshold or self._centroids is None:
+            return None
+        probe = np.argsort(-(self._centroids @ qvec))[:self.ivf_nprobe]
+        rows = [r for p in probe for r in self._lists[p]]
+        return np.asarray(rows, dtype=np.int64)
+    # ---------- reads ----------
+    @staticmethod
+    def _top(rows: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not len(rows) or k <= 0:
+            return []
+        k = min(k, len(rows))
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+        return [(int(rows[i]), float(scores[i])) for i in idx]
+    def query(self, qvec, top_k: int, document_id: Optional[str] = None, with_embeddings: bool = False) -> List[Dict]:
+        q = np.asarray(qvec, dtype=np.float32).reshape(self.dim)
+        # snapshot under the lock, scan and read records outside it; published rows are never
+        # rewritten and segments are replaced (not mutated) on growth, so the snapshot stays valid
+        with self._lock:
+            segments = list(self._segments)
+            if document_id is not None:
+                rows = np.asarray(self._postings.get(str(document_id), []), dtype=np.int64)
+            else:
+                rows = self._candidate_rows(q)
+        if rows is not None:
+            best = self._top(rows, self._vectors(rows, segments) @ q, top_k)
+        else:
+            best = []
+            for seg, vecs in enumerate(segments):
+                lo = seg * self.segment_rows
+                best.extend(self._top(np.arange(lo, lo + len(vecs)), vecs @ q, top_k))
+            best = sorted(best, key=lambda x: -x[1])[:top_k]
+        return self._records([row for row, _ in best], segments, with_embeddings)
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            segments = list(self._segments)
+            found = [(i, self._id_to_row[i]) for i in ids if i in self._id_to_row]
+        vecs = self._vectors(np.asarray([r for _, r in found], dtype=np.int64), segments)
+        return {i: vecs[k] for k, (i, _) in enumerate(found)}
+    def get(self, ids: List[str], with_embeddings: bool = False) -> List[Dict]:
+        with self._lock:
+            segments = list(self._segments)
+            rows = [self._id_to_row[i] for i in ids if i in self._id_to_row]
+        return self._records(rows, segments, with_embeddings)
+    def get_by_document(self, document_id: str, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            rows = self._postings.get(str(document_id), [])[:limit]
+        return [self._record(row) for row in rows]
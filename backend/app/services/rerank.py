@@ -0,0 +1,34 @@
+from typing import List, Sequence
+import numpy as np
+def mmr(qvec: np.ndarray | None, vecs: np.ndarray, k: int, lam: float = 0.7,
+        relevance: Sequence[float] | None = None) -> List[int]:
+    """
+    Maximal marginal relevance over candidate rows `vecs` (L2-normalized, one per candidate).
+    Picks k indices, each maximizing lam * rel(c) - (1 - lam) * max sim(c, already picked).
+    rel is `relevance` (e.g. the hybrid retriever's fused score, so BM25-found chunks keep their
+    rank) min-max scaled to [0, 1], else the cosine to `qvec`. Vectors only measure redundancy
+    in the first case. Candidates (near) identical to a picked one are never picked.
+    """
+    n = len(vecs)
+    if not n or k <= 0:
+        return []
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if relevance is not None:
+        rel = np.asarray(relevance, dtype=np.float32)
+        span = float(rel.max() - rel.min())
+        rel = (rel - rel.min()) / span if span > 0 else np.ones(n, dtype=np.float32)
+    else:
+        rel = vecs @ np.asarray(qvec, dtype=np.float32)
+    sim = vecs @ vecs.T
+    redundancy = np.zeros(n, dtype=np.float32)
+    open_ = np.ones(n, dtype=bool)
+    picked: List[int] = []
+    for _ in range(min(k, n)):
+        score = np.where(open_, lam * rel - (1 - lam) * redundancy, -np.inf)
+        i = int(np.argmax(score))
+        if not np.isfinite(score[i]):
+            break
+        picked.append(i)
+        redundancy = np.maximum(redundancy, sim[i])
+        open_ &= sim[i] < 0.999
+    return picked
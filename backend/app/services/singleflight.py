@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+class _Flight:
+    def __init__(self, coro: Awaitable[Any]):
+        self.task = asyncio.ensure_future(coro)
+        self.waiters = 0
+class _Fanout:
+    """One producer, many readers: every item is buffered so a late reader replays from the start."""
+    def __init__(self, events: AsyncIterator[Any]):
+        self.buf: List[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.waiters = 0
+        self._more = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(events))
+    def _wake(self):
+        self._more.set()
+        self._more = asyncio.Event()
+    async def _pump(self, events):
+        try:
+            async for item in events:
+                self.buf.append(item)
+                self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                await events.aclose()
+            finally:
+                self.done = True
+                self._wake()
+class SingleFlight:
+    """
+    Coalesces identical concurrent work. Callers with the same key share one in-flight call (`do`)
+    or one in-flight event stream (`stream`); nothing is kept once it finishes, so this is request
+    deduplication, not a cache. The shared work is cancelled only when its last caller goes away.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, _Flight] = {}
+        self._streams: Dict[Hashable, _Fanout] = {}
+        self.started = 0
+        self.shared = 0
+    @staticmethod
+    def _forget(table: Dict, key, entry):
+        def cb(task: asyncio.Future):
+            if table.get(key) is entry:
+                del table[key]
+            if not task.cancelled():
+                task.exception()  # retrieved here so an unawaited failure is not logged as lost
+        return cb
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fl = self._calls.get(key)
+        if fl is None:
+            fl = self._calls[key] = _Flight(fn())
+            fl.task.add_done_callback(self._forget(self._calls, key, fl))
+            self.started += 1
+        else:
+            self.shared += 1
+        fl.waiters += 1
+        try:
+            # shielded: one caller disconnecting must not cancel the work the others wait on
+            return await asyncio.shield(fl.task)
+        finally:
+            fl.waiters -= 1
+            if not fl.waiters and not fl.task.done():
+                fl.task.cancel()
+    async def stream(self, key: Hashable, make_events: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        fan = self._streams.get(key)
+        if fan is None:
+            fan = self._streams[key] = _Fanout(make_events())
+            fan.task.add_done_callback(self._forget(self._streams, key, fan))
+            self.started += 1
+        else:
+            self.shared += 1
+        fan.waiters += 1
+        try:
+            i = 0
+            while True:
+                if i < len(fan.buf):
+                    yield fan.buf[i]
+                    i += 1
+                elif fan.done:
+                    break
+                else:
+                    await fan._more.wait()
+            if fan.error is not None:
+                raise fan.error
+        finally:
+            fan.waiters -= 1
+            if not fan.waiters and not fan.task.done():
+                fan.task.cancel()
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls) + len(self._streams), "started": self.started, "shared": self.shared}
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List
+from app.core.config import settings
+from app.services.llm import acomplete_with_fallback
+SYSTEM = "You are a concise assistant. Return PLAIN TEXT only (no markdown, no emojis)."
+MAP_PROMPT = ("Summarize this part of a document in a few sentences. "
+              "Keep names, numbers and key terms.\n\nTEXT:\n{text}\n\nSummary:")
+REDUCE_PROMPT = ("Below are summaries of consecutive parts of one document, in order. "
+                 "Combine them into a single summary{style}.\n\n{parts}\n\nSummary:")
+_sem: asyncio.Semaphore | None = None
+def _get_sem() -> asyncio.Semaphore:
+    # shared by every ingest job, so concurrent uploads do not multiply the LLM fan-out
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(max(1, settings.summary_concurrency))
+    return _sem
+async def _llm(prompt: str) -> str:
+    async with _get_sem():
+        return (await acomplete_with_fallback(prompt, system=SYSTEM) or "").strip()
+def _reduce_prompt(nodes: List[Dict], style: str | None = None) -> str:
+    parts = "\n\n".join(f"[{i+1}] {n['summary']}" for i, n in enumerate(nodes))
+    return REDUCE_PROMPT.format(style=f" ({style})" if style else "", parts=parts)
+async def _reduce(nodes: List[Dict]) -> Dict:
+    return {"summary": await _llm(_reduce_prompt(nodes)), "chunks": [nodes[0]["chunks"][0], nodes[-1]["chunks"][1]]}
+async def build_summary_tree(chunks: List[Dict]) -> Dict[str, Any]:
+    """
+    Map-reduce summary of a document's chunks (in chunk_index order). Groups of
+    `summary_group_chunks` chunks are summarized in parallel, then every `summary_fanin` summaries
+    are reduced into one, level by level, until a single document summary remains.
+    levels[0] holds the group summaries and levels[-1] the document summary; each node records the
+    [first, last] chunk_index it covers.
+    """
+    chunks = sorted(chunks, key=lambda c: c["chunk_index"])
+    size, fanin = max(1, settings.summary_group_chunks), max(2, settings.summary_fanin)
+    groups = [chunks[i:i + size] for i in range(0, len(chunks), size)]
+    summaries = await asyncio.gather(*[_llm(MAP_PROMPT.format(text="\n\n".join(c["text"] for c in g))) for g in groups])
+    levels = [[{"summary": s, "chunks": [g[0]["chunk_index"], g[-1]["chunk_index"]]} for g, s in zip(groups, summaries)]]
+    while len(levels[-1]) > 1:
+        nodes = levels[-1]
+        levels.append(list(await asyncio.gather(*[_reduce(nodes[i:i + fanin]) for i in range(0, len(nodes), fanin)])))
+    return {"summary": levels[-1][0]["summary"], "levels": levels, "chunks": len(chunks),
+            "created_at": datetime.utcnow()}
+def sections(tree: Dict[str, Any]) -> List[Dict]:
+    """The nodes the document summary was reduced from (the group summaries for short documents)."""
+    levels = tree["levels"]
+    return levels[-2] if len(levels) > 1 else levels[-1]
+async def restyle(tree: Dict[str, Any], style: str) -> str:
+    """Re-run only the final reduce step with a caller-supplied style; one LLM call."""
+    return (await acomplete_with_fallback(_reduce_prompt(sections(tree), style), system=SYSTEM) or "").strip()
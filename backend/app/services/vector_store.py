@@ -1,49 +1,294 @@
 ﻿from typing import List, Dict, Optional
-import re, math, zlib
+import os, zlib, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tenacity import Retrying, stop_after_attempt, wait_exponential
 from chromadb import HttpClient
 from app.core.config import settings
-_client = HttpClient(host=settings.chroma_host, port=settings.chroma_port)
+from app.services.cache import TTLCache, MongoCache
 EMBED_DIM = 384  # keep whatever you already use
-_collection = _client.get_or_create_collection(f"bkp_chunks_{EMBED_DIM}")
-def _hash_embed_batch(texts: List[str], dim: int) -> List[List[float]]:
-    out = []
-    for t in texts:
-        v = [0.0]*dim
-        for tok in re.findall(r"[A-Za-z0-9]+", (t or "").lower()):
-            h = zlib.adler32(tok.encode("utf-8")) % dim
-            v[h] += 1.0
-        n = math.sqrt(sum(x*x for x in v)) or 1.0
-        out.append([x/n for x in v])
-    return out
-def _embed_batch(texts: List[str]) -> List[List[float]]:
+# bytes.translate table equivalent to the original r"[A-Za-z0-9]+" tokenizer: after lower() and an
+# ascii encode (non-ascii -> "?"), every byte outside [A-Za-z0-9] becomes a separator
+_TOKEN_TABLE = bytes(c if chr(c).isascii() and chr(c).isalnum() else 0x20 for c in range(256))
+_bucket_cache: Dict[bytes, int] = {}
+_BUCKET_CACHE_MAX = 500_000
+class _ChromaStore:
+    def __init__(self):
+        self._client = HttpClient(host=settings.chroma_host, port=settings.chroma_port)
+        self._collection = self._client.get_or_create_collection(f"bkp_chunks_{EMBED_DIM}")
+        try:
+            self.max_batch = self._client.get_max_batch_size()
+        except Exception:
+            self.max_batch = None
+    def add(self, ids, documents, metadatas, embeddings):
+        self._collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings.tolist())
+    def query(self, qvec, top_k: int, document_id: Optional[str] = None, with_embeddings: bool = False) -> List[Dict]:
+        where = {"document_id": document_id} if document_id else None
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+        res = self._collection.query(query_embeddings=[qvec.tolist()], n_results=top_k, where=where, include=include)
+        hits: List[Dict] = []
+        if res.get("ids"):
+            for i in range(len(res["ids"][0])):
+                hits.append({
+                    "id": res["ids"][0][i],
+                    "text": res["documents"][0][i],
+                    "metadata": res["metadatas"][0][i],
+                })
+                if with_embeddings:
+                    hits[-1]["embedding"] = np.asarray(res["embeddings"][0][i], dtype=np.float32)
+        return hits
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        res = self._collection.get(ids=ids, include=["embeddings"])
+        return {i: np.asarray(e, dtype=np.float32) for i, e in zip(res.get("ids") or [], res.get("embeddings") or [])}
+    def get(self, ids: List[str], with_embeddings: bool = False) -> List[Dict]:
+        res = self._collection.get(ids=ids, include=["documents","metadatas"] + (["embeddings"] if with_embeddings else []))
+        hits = [{"id": i, "text": d, "metadata": m}
+                for i, d, m in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or [])]
+        if with_embeddings:
+            for h, e in zip(hits, res.get("embeddings") or []):
+                h["embedding"] = np.asarray(e, dtype=np.float32)
+        return hits
+    def get_by_document(self, document_id: str, limit: int = 100) -> List[Dict]:
+        res = self._collection.get(
+            where={"document_id": document_id},
+            limit=limit,
+            include=["documents","metadatas"]
+        )
+        hits = []
+        ids = res.get("ids") or []
+        docs = res.get("documents") or []
+        metas = res.get("metadatas") or []
+        for i in range(len(ids)):
+            hits.append({"id": ids[i], "text": docs[i], "metadata": metas[i]})
+        return hits
+_store = None
+_store_lock = threading.Lock()
+_query_pool: ThreadPoolExecutor | None = None
+_retrieval_cache = None
+_vector_cache = None
+_bm25 = None
+def _get_store():
+    global _store
+    if _store is not None:
+        return _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        if settings.vector_backend == "local":
+            from app.services.local_index import LocalVectorIndex
+            _store = LocalVectorIndex(
+                os.path.join(settings.vector_store_dir, f"bkp_chunks_{EMBED_DIM}"), EMBED_DIM,
+                segment_rows=settings.vector_segment_rows,
+                ivf_threshold=settings.vector_ivf_threshold,
+                ivf_lists=settings.vector_ivf_lists,
+                ivf_nprobe=settings.vector_ivf_nprobe,
+            )
+        else:
+            _store = _ChromaStore()
+    return _store
+def _get_bm25():
+    global _bm25
+    if _bm25 is None and settings.bm25_enabled:
+        with _store_lock:
+            if _bm25 is None:
+                from app.services.bm25_index import BM25Index
+                _bm25 = BM25Index(settings.bm25_dir, k1=settings.bm25_k1, b=settings.bm25_b)
+    return _bm25
+def _index_terms(ids, documents, metadatas):
+    bm25 = _get_bm25()
+    if bm25 is not None:
+        bm25.add(ids, documents, metadatas)
+def backfill_terms(document_id: str, limit: int) -> int:
+    """BM25 postings for a document's chunks already in the vector store; no-op once it has a shard."""
+    bm25 = _get_bm25()
+    if bm25 is None or bm25.has(document_id):
+        return 0
+    hits = _get_store().get_by_document(document_id, limit=limit)
+    return bm25.add([h["id"] for h in hits], [h.get("text") or "" for h in hits], [h.get("metadata") or {} for h in hits])
+def _get_retrieval_cache():
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        backend = settings.retrieval_cache_backend
+        if backend == "mongo":
+            _retrieval_cache = MongoCache(settings.mongo_uri, settings.mongo_db, "retrieval_cache",
+                                          ttl=settings.retrieval_cache_ttl_s)
+        elif backend != "off" and settings.retrieval_cache_size > 0:
+            _retrieval_cache = TTLCache(settings.retrieval_cache_size, settings.retrieval_cache_ttl_s)
+        else:
+            _retrieval_cache = False
+    return _retrieval_cache or None
+def _get_vector_cache():
+    # chunk vectors by id, kept in-process next to the retrieval cache (numpy arrays are not BSON);
+    # a chunk id is never rewritten with different text, so entries need no invalidation
+    global _vector_cache
+    if _vector_cache is None:
+        _vector_cache = TTLCache(settings.embedding_cache_size, settings.retrieval_cache_ttl_s) \
+            if settings.embedding_cache_size > 0 else False
+    return _vector_cache or None
+def retrieval_cache_stats() -> Dict:
+    cache = _get_retrieval_cache()
+    return cache.stats() if cache else {"backend": "off"}
+def _invalidate_documents(metadatas):
+    cache = _get_retrieval_cache()
+    if not cache:
+        return
+    for doc_id in {str((m or {}).get("document_id")) for m in metadatas}:
+        cache.invalidate_tag(f"doc:{doc_id}")
+    cache.invalidate_tag("doc:*")  # unscoped searches may now rank differently
+def _tokenize(text: str) -> List[bytes]:
+    return (text or "").lower().encode("ascii", "replace").translate(_TOKEN_TABLE).split()
+def _token_buckets(tokens: List[bytes], dim: int) -> np.ndarray:
+    # memoized token -> adler32 hash; the modulo is applied per call so the table is dim-independent.
+    # Shared by the ingest and query threads: a full table is replaced, never cleared in place, so
+    # the dict this call holds keeps every entry it filled until the lookups below are done
+    global _bucket_cache
+    cache = _bucket_cache
+    missing = set(tokens).difference(cache)
+    if len(cache) + len(missing) > _BUCKET_CACHE_MAX:
+        cache = _bucket_cache = {}
+        missing = set(tokens)
+    for tok in missing:
+        cache[tok] = zlib.adler32(tok)
+    return np.fromiter(map(cache.__getitem__, tokens), dtype=np.int64, count=len(tokens)) % dim
+def _hash_embed_batch(texts: List[str], dim: int) -> np.ndarray:
+    """
+    Bag-of-words hashed into `dim` buckets, L2-normalized. Returns a float32 (len(texts), dim) matrix.
+    Counts and norms are computed in float64 so the float32 result is bit-identical to the vectors
+    already stored in the bkp_chunks_* collections.
+    """
+    per_text = [_tokenize(t) for t in texts]
+    counts = np.fromiter(map(len, per_text), dtype=np.int64, count=len(per_text))
+    toks = [tok for found in per_text for tok in found]
+    flat = np.repeat(np.arange(len(texts), dtype=np.int64) * dim, counts) + _token_buckets(toks, dim)
+    mat = np.bincount(flat, minlength=len(texts) * dim).astype(np.float64).reshape(len(texts), dim)
+    norms = np.sqrt(np.einsum("ij,ij->i", mat, mat))
+    norms[norms == 0] = 1.0
+    mat /= norms[:, None]
+    return mat.astype(np.float32)
+def _embed_batch(texts: List[str]) -> np.ndarray:
     return _hash_embed_batch(texts, EMBED_DIM)  # keep your real providers if you have them
-def add_documents(ids, documents, metadatas):
-    embeddings = _embed_batch(documents)
-    _collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
-def similarity_search(query: str, top_k: int = 5, document_id: Optional[str] = None):
-    qvec = _embed_batch([query])[0]
-    where = {"document_id": document_id} if document_id else None
-    res = _collection.query(query_embeddings=[qvec], n_results=top_k, where=where)
-    hits: List[Dict] = []
-    if res.get("ids"):
-        for i in range(len(res["ids"][0])):
-            hits.append({
-                "id": res["ids"][0][i],
-                "text": res["documents"][0][i],
-                "metadata": res["metadatas"][0][i],
-            })
+def _batch_size() -> int:
+    size = max(1, settings.vector_write_batch)
+    cap = getattr(_get_store(), "max_batch", None)
+    return min(size, cap) if cap else size
+def _write_batch(ids, documents, metadatas, embeddings):
+    # both stores skip ids they already hold, so re-sending a half-written batch is idempotent
+    for attempt in Retrying(stop=stop_after_attempt(max(1, settings.vector_write_retries)),
+                            wait=wait_exponential(multiplier=0.2, max=5), reraise=True):
+        with attempt:
+            _get_store().add(ids, documents, metadatas, embeddings)
+def add_documents(ids, documents, metadatas, embeddings=None):
+    """Store chunks in settings.vector_write_batch batches; pass `embeddings` to reuse known vectors."""
+    size = _batch_size()
+    for lo in range(0, len(ids), size):
+        hi = lo + size
+        emb = _embed_batch(documents[lo:hi]) if embeddings is None else np.asarray(embeddings[lo:hi], dtype=np.float32)
+        _write_batch(ids[lo:hi], documents[lo:hi], metadatas[lo:hi], emb)
+    _index_terms(ids, documents, metadatas)
+    _invalidate_documents(metadatas)
+async def aadd_documents(ids, documents, metadatas, embeddings=None):
+    """
+    add_documents for async callers: embedding and writes run on worker threads, and batch N+1 is
+    embedded while batch N is being written.
+    """
+    size = await asyncio.to_thread(_batch_size)
+    pending = None
+    try:
+        for lo in range(0, len(ids), size):
+            hi = lo + size
+            if embeddings is None:
+                emb = await asyncio.to_thread(_embed_batch, documents[lo:hi])
+            else:
+                emb = np.asarray(embeddings[lo:hi], dtype=np.float32)
+            if pending is not None:
+                await pending
+            pending = asyncio.ensure_future(
+                asyncio.to_thread(_write_batch, ids[lo:hi], documents[lo:hi], metadatas[lo:hi], emb))
+        if pending is not None:
+            await pending
+        await asyncio.to_thread(_index_terms, ids, documents, metadatas)
+        await asyncio.to_thread(_invalidate_documents, metadatas)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+def get_embeddings(ids: List[str]) -> Dict[str, np.ndarray]:
+    """Stored vectors by id; unknown ids are omitted."""
+    return _get_store().get_embeddings(ids)
+def _hybrid_search(query: str, top_k: int, document_id: Optional[str], with_embeddings: bool = False) -> List[Dict]:
+    """
+    Vector and BM25 candidates fused by reciprocal rank: score = sum of 1 / (rrf_k + rank) over
+    the lists a chunk appears in. Chunks found only by BM25 are fetched from the store. Each hit
+    carries its fused "score" (vector rank alone when BM25 is off) for rerankers, and its stored
+    vector as "embedding" when with_embeddings is set.
+    """
+    store = _get_store()
+    bm25 = _get_bm25()
+    if bm25 is None:
+        hits = store.query(_embed_batch([query])[0], top_k, document_id, with_embeddings)
+        return [dict(h, score=1.0 / (settings.rrf_k + rank + 1)) for rank, h in enumerate(hits)]
+    n = max(top_k, settings.hybrid_candidates)
+    vec_hits = store.query(_embed_batch([query])[0], n, document_id, with_embeddings)
+    term_hits = bm25.search(query, n, document_id)
+    scores: Dict[str, float] = {}
+    for ranked in ([h["id"] for h in vec_hits], [i for i, _ in term_hits]):
+        for rank, id_ in enumerate(ranked):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (settings.rrf_k + rank + 1)
+    best = sorted(scores, key=lambda i: -scores[i])[:top_k]
+    by_id = {h["id"]: h for h in vec_hits}
+    missing = [i for i in best if i not in by_id]
+    if missing:
+        by_id.update((h["id"], h) for h in store.get(missing, with_embeddings))
+    return [dict(by_id[i], score=scores[i]) for i in best if i in by_id]
+def embed_query(query: str) -> np.ndarray:
+    return _embed_batch([query])[0]
+def similarity_search(query: str, top_k: int = 5, document_id: Optional[str] = None, with_embeddings: bool = False):
+    """Hits as {"id","text","metadata"}; with_embeddings adds each chunk's stored vector as "embedding"."""
+    return _search(query, top_k, document_id, with_embeddings)
+def _search(query: str, top_k: int, document_id: Optional[str], with_embeddings: bool = False):
+    cache = _get_retrieval_cache()
+    vcache = _get_vector_cache() if with_embeddings else None
+    # neither the embedder nor the BM25 tokenizer sees case or spacing, so neither may split cache entries
+    key = f"{document_id or '*'}|{top_k}|{' '.join((query or '').lower().split())}"
+    hits = cache.get(key) if cache else None
+    if hits is None:
+        hits = _hybrid_search(query, top_k, document_id, with_embeddings)
+        if vcache:
+            for h in hits:
+                vcache.set(h["id"], h["embedding"])
+        if cache:
+            # cached without vectors: the mongo backend can't hold them, and most callers don't want them
+            cache.set(key, [{k: v for k, v in h.items() if k != "embedding"} for h in hits],
+                      tags=(f"doc:{document_id}" if document_id else "doc:*",))
+        return [dict(h) for h in hits]
+    hits = [dict(h) for h in hits]
+    if with_embeddings and hits:
+        # vectors of cached hits come from the vector cache; only evicted ones go back to the store
+        vecs = {h["id"]: v for h in hits if vcache and (v := vcache.get(h["id"])) is not None}
+        missing = [h["id"] for h in hits if h["id"] not in vecs]
+        if missing:
+            fetched = get_embeddings(missing)
+            if vcache:
+                for i, v in fetched.items():
+                    vcache.set(i, v)
+            vecs.update(fetched)
+        hits = [dict(h, embedding=vecs[h["id"]]) for h in hits if h["id"] in vecs]
     return hits
 def get_chunks_by_document(document_id: str, limit: int = 100):
     """Return all chunks for a single document_id (no retrieval, just fetch)."""
-    res = _collection.get(
-        where={"document_id": document_id},
-        limit=limit,
-        include=["ids","documents","metadatas"]
-    )
-    hits = []
-    ids = res.get("ids") or []
-    docs = res.get("documents") or []
-    metas = res.get("metadatas") or []
-    for i in range(len(ids)):
-        hits.append({"id": ids[i], "text": docs[i], "metadata": metas[i]})
-    return hits
+    return _get_store().get_by_document(document_id, limit)
+def _get_query_pool() -> ThreadPoolExecutor:
+    global _query_pool
+    if _query_pool is None:
+        _query_pool = ThreadPoolExecutor(max_workers=settings.vector_query_workers, thread_name_prefix="vector-query")
+    return _query_pool
+async def _run_query(fn, *args):
+    # bounded dedicated pool: a slow vector store queues retrievals instead of starving the default executor
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(_get_query_pool(), fn, *args),
+                                  timeout=settings.vector_query_timeout_s)
+async def asimilarity_search(query: str, top_k: int = 5, document_id: Optional[str] = None,
+                             with_embeddings: bool = False):
+    """similarity_search for async handlers. Raises asyncio.TimeoutError after settings.vector_query_timeout_s."""
+    return await _run_query(similarity_search, query, top_k, document_id, with_embeddings)
+async def aget_chunks_by_document(document_id: str, limit: int = 100):
+    return await _run_query(get_chunks_by_document, document_id, limit)
@@ -0,0 +1,60 @@
+"""
+Hash-embedder throughput: legacy per-token loop vs. the vectorized _hash_embed_batch.
+
+    cd backend && python -m bench.bench_embed --chunks 2000
+"""
+import argparse, math, random, re, time, zlib
+import numpy as np
+from app.services.vector_store import _hash_embed_batch, EMBED_DIM
+def _legacy_hash_embed_batch(texts, dim):
+    # verbatim copy of the pre-vectorization implementation, kept as the reference
+    out = []
+    for t in texts:
+        v = [0.0]*dim
+        for tok in re.findall(r"[A-Za-z0-9]+", (t or "").lower()):
+            h = zlib.adler32(tok.encode("utf-8")) % dim
+            v[h] += 1.0
+        n = math.sqrt(sum(x*x for x in v)) or 1.0
+        out.append([x/n for x in v])
+    return out
+def _corpus(n: int, chunk_size: int, seed: int = 7):
+    rnd = random.Random(seed)
+    vocab = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 10))) for _ in range(5000)]
+    vocab += [str(i) for i in range(200)]
+    out = []
+    for _ in range(n):
+        words, size = [], 0
+        while size < chunk_size:
+            w = rnd.choice(vocab)
+            if rnd.random() < 0.1:
+                w = w.capitalize() + rnd.choice([",", ".", ";", ""])
+            words.append(w)
+            size += len(w) + 1
+        out.append(" ".join(words))
+    out.append("")  # empty chunk must embed to the zero vector
+    return out
+def _rate(fn, texts, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(texts, EMBED_DIM)
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, default=2000)
+    ap.add_argument("--chunk-size", type=int, default=1200)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    texts = _corpus(args.chunks, args.chunk_size)
+    legacy = np.asarray(_legacy_hash_embed_batch(texts, EMBED_DIM), dtype=np.float32)
+    fast = _hash_embed_batch(texts, EMBED_DIM)
+    if fast.dtype != np.float32 or not np.array_equal(legacy.view(np.uint32), fast.view(np.uint32)):
+        raise SystemExit("vectorized embedder is not bit-compatible with the legacy vectors")
+    before = _rate(_legacy_hash_embed_batch, texts, args.repeat)
+    after = _rate(_hash_embed_batch, texts, args.repeat)
+    print(f"chunks={len(texts)} chunk_size~{args.chunk_size} dim={EMBED_DIM}")
+    print(f"legacy     {before:10.1f} chunks/sec")
+    print(f"vectorized {after:10.1f} chunks/sec  ({after / before:.1f}x)")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Stage-level ingestion/retrieval benchmarks, fully offline (generated corpora, in-memory Chroma).
+
+    cd backend && python -m bench.bench_stages --sizes 10KB,1MB,10MB --out bench_results.json
+    cd backend && python -m bench.bench_stages --sizes 10KB,1MB --compare bench_results.json --threshold 0.2
+
+Every (stage, size) pair runs in its own subprocess so peak RSS is per stage. Results are JSON:
+throughput (bytes/s, chunks/s or queries/s), p50/p95/p99 latency per sample and peak RSS.
+--compare exits non-zero when a stage's p50 is more than --threshold slower than the baseline.
+"""
+import argparse, asyncio, json, os, platform, resource, subprocess, sys, time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+import numpy as np
+STAGES = ["extract_text[txt]", "extract_text[docx]", "extract_text[pdf]", "chunk_text", "hash_embed",
+          "add_documents", "similarity_search", "ask_context"]
+_CTYPES = {"txt": "text/plain", "pdf": "application/pdf",
+           "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+def parse_size(s: str) -> int:
+    s = s.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if s.endswith(unit):
+            return int(float(s[:-len(unit)]) * _UNITS[unit])
+    return int(s)
+def fmt_size(n: int) -> str:
+    for unit in ("GB", "MB", "KB"):
+        if n >= _UNITS[unit] and n % _UNITS[unit] == 0:
+            return f"{n // _UNITS[unit]}{unit}"
+    return f"{n}B"
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    rss = resource.getrusage(who).ru_maxrss  # KiB on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+def _repeat(fn: Callable[[], None], repeat: int, max_seconds: float) -> List[float]:
+    # at least one sample, then stop early once the stage has used its time budget
+    samples, spent = [], 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        spent += samples[-1]
+        if spent >= max_seconds:
+            break
+    return samples
+def _chunks(size: int) -> List[Dict]:
+    from bench.corpus import text
+    from app.ingestion.chunk import chunk_text
+    return chunk_text(text(size))
+def _populate(chunks: List[Dict], doc_id: str = "bench"):
+    from bench.fakes import install_fake_store
+    from app.services.vector_store import add_documents
+    install_fake_store()
+    add_documents([f"{doc_id}:{c['chunk_index']}" for c in chunks], [c["text"] for c in chunks],
+                  [{"document_id": doc_id, "chunk_index": c["chunk_index"], "filename": "bench.txt"} for c in chunks])
+def run_stage(stage: str, size: int, args) -> Dict:
+    from app.core.config import settings
+    settings.parse_timeout_s = 24 * 3600.0
+    extra: Dict = {}
+    if stage.startswith("extract_text["):
+        from bench.corpus import ensure
+        from app.ingestion.parsers import extract_text, _get_pool, _from_text, shutdown_pool
+        fmt = stage[len("extract_text["):-1]
+        path = ensure(args.corpus_dir, fmt, size)
+        extra["file_bytes"] = os.path.getsize(path)
+        pool = _get_pool()
+        # spawn the workers and import the parser module in each before timing starts
+        for f in [pool.submit(_from_text, os.devnull) for _ in range(4 * pool._max_workers)]:
+            f.result()
+        samples = _repeat(lambda: asyncio.run(extract_text(path, _CTYPES[fmt])), args.repeat, args.max_seconds)
+        shutdown_pool()
+        unit, per_sample = "bytes", size
+    elif stage == "chunk_text":
+        from bench.corpus import text
+        from app.ingestion.chunk import chunk_text
+        body = text(size)
+        samples = _repeat(lambda: chunk_text(body), args.repeat, args.max_seconds)
+        unit, per_sample = "bytes", size
+    elif stage == "hash_embed":
+        from app.services.vector_store import _hash_embed_batch, EMBED_DIM
+        texts = [c["text"] for c in _chunks(size)]
+        samples = _repeat(lambda: _hash_embed_batch(texts, EMBED_DIM), args.repeat, args.max_seconds)
+        unit, per_sample = "chunks", len(texts)
+    elif stage == "add_documents":
+        chunks = _chunks(size)
+        from bench.fakes import install_fake_store
+        from app.services.vector_store import add_documents
+        ids = [f"bench:{c['chunk_index']}" for c in chunks]
+        docs = [c["text"] for c in chunks]
+        metas = [{"document_id": "bench", "chunk_index": c["chunk_index"]} for c in chunks]
+        def once():
+            install_fake_store()
+            add_documents(ids, docs, metas)
+        samples = _repeat(once, args.repeat, args.max_seconds)
+        unit, per_sample = "chunks", len(chunks)
+    elif stage in ("similarity_search", "ask_context"):
+        chunks = _chunks(size)
+        _populate(chunks)
+        from bench.corpus import queries as make_queries
+        queries = make_queries(args.queries)
+        extra["chunks"] = len(chunks)
+        if stage == "similarity_search":
+            from app.services.vector_store import similarity_search
+            it = iter(queries)
+            samples = _repeat(lambda: similarity_search(next(it), top_k=8), len(queries), args.max_seconds)
+        else:
+            from app.api.knowledge import _ask_hits
+            from app.services.context import pack_context, budget_for
+            async def assemble(q):
+                hits = await _ask_hits(q, "bench")
+                return pack_context(hits, q, budget_for("llama3.1:8b"))
+            async def loop():
+                out = []
+                for q in queries:
+                    t0 = time.perf_counter()
+                    await assemble(q)
+                    out.append(time.perf_counter() - t0)
+                return out
+            samples = asyncio.run(loop())
+        unit, per_sample = "queries", 1
+    else:
+        raise SystemExit(f"unknown stage {stage!r}")
+    ms = np.asarray(samples) * 1000
+    p50 = float(np.percentile(ms, 50))
+    return {
+        "stage": stage, "size": fmt_size(size), "size_bytes": size, "unit": unit, "samples": len(samples),
+        "throughput": round(per_sample / (p50 / 1000), 2) if p50 else None,
+        "p50_ms": round(p50, 3), "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3), "mean_ms": round(float(ms.mean()), 3),
+        "peak_rss_mb": _peak_rss_mb(), "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **extra,
+    }
+def _child_cmd(stage: str, size: int, args) -> List[str]:
+    return [sys.executable, "-m", "bench.bench_stages", "--child", stage, str(size),
+            "--repeat", str(args.repeat), "--max-seconds", str(args.max_seconds),
+            "--queries", str(args.queries), "--corpus-dir", args.corpus_dir]
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """Human-readable lines for regressions (p50 slower than baseline by more than threshold)."""
+    bad = []
+    for key, new in sorted(results.items()):
+        old = baseline.get(key)
+        if not old or not old.get("p50_ms") or "error" in new:
+            continue
+        ratio = new["p50_ms"] / old["p50_ms"]
+        flag = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{key:36s} {old['p50_ms']:11.3f} -> {new['p50_ms']:11.3f} ms  x{ratio:5.2f}  {flag}")
+        if flag != "ok":
+            bad.append(f"{key}: p50 {old['p50_ms']}ms -> {new['p50_ms']}ms (x{ratio:.2f})")
+    return bad
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10KB,1MB,10MB,100MB")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--max-seconds", type=float, default=30.0, help="per-stage time budget (>= 1 sample)")
+    ap.add_argument("--queries", type=int, default=200, help="queries for the retrieval stages")
+    ap.add_argument("--corpus-dir", default=os.path.join("bench", ".corpus"))
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON")
+    ap.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown, 0.2 = 20%%")
+    ap.add_argument("--inline", action="store_true", help="run stages in this process (no per-stage RSS)")
+    ap.add_argument("--child", nargs=2, metavar=("STAGE", "SIZE"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(run_stage(args.child[0], int(args.child[1]), args)))
+        return
+    results: Dict[str, Dict] = {}
+    for stage in [s.strip() for s in args.stages.split(",") if s.strip()]:
+        for size in [parse_size(s) for s in args.sizes.split(",") if s.strip()]:
+            key = f"{stage}@{fmt_size(size)}"
+            if args.inline:
+                res = run_stage(stage, size, args)
+            else:
+                proc = subprocess.run(_child_cmd(stage, size, args), capture_output=True, text=True)
+                lines = proc.stdout.strip().splitlines()
+                try:
+                    res = json.loads(lines[-1])
+                except (IndexError, ValueError):
+                    res = {"stage": stage, "size": fmt_size(size), "error": (proc.stderr.strip().splitlines() or ["?"])[-1]}
+            results[key] = res
+            if "error" in res:
+                print(f"{key:36s} ERROR {res['error']}", file=sys.stderr)
+            else:
+                print(f"{key:36s} p50 {res['p50_ms']:11.3f} ms  p95 {res['p95_ms']:11.3f} ms  "
+                      f"{res['throughput']:>14} {res['unit']}/s  rss {res['peak_rss_mb']} MB", file=sys.stderr)
+    report = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count()}, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        bad = compare(results, baseline, args.threshold)
+        if bad:
+            raise SystemExit("regressions:\n  " + "\n  ".join(bad))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Deterministic synthetic documents for the benchmarks: prose-like text split into sentences and
+paragraphs, written as TXT, DOCX (python-docx) or a plain text-based PDF. `size` is the amount of
+text in bytes; the file itself is larger for DOCX/PDF.
+"""
+import os, random
+from typing import Iterator, List
+_LINE = 90
+_LINES_PER_PAGE = 45
+def _vocab(rnd: random.Random) -> List[str]:
+    words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 10))) for _ in range(5000)]
+    return words + [str(i) for i in range(200)]
+def paragraphs(size: int, seed: int = 7) -> Iterator[str]:
+    """Paragraphs of 2-8 sentences totalling ~`size` bytes (counting a blank line between them)."""
+    rnd = random.Random(seed)
+    vocab = _vocab(rnd)
+    done = 0
+    while done < size:
+        sents = []
+        for _ in range(rnd.randint(2, 8)):
+            words = rnd.choices(vocab, k=rnd.randint(6, 24))
+            sents.append(" ".join(words).capitalize() + rnd.choice([".", ".", ".", "?", "!"]))
+        para = " ".join(sents)
+        done += len(para) + 2
+        yield para
+def text(size: int, seed: int = 7) -> str:
+    return "\n\n".join(paragraphs(size, seed))
+def queries(n: int, seed: int = 11) -> List[str]:
+    """Short questions made of 3-8 leading words of corpus sentences, so retrieval has matches."""
+    rnd = random.Random(seed)
+    sents = [s for p in paragraphs(64 * 1024, seed=7) for s in p.split(". ")]
+    return [" ".join(rnd.choice(sents).split()[:rnd.randint(3, 8)]) for _ in range(n)]
+def write_txt(path: str, size: int, seed: int = 7):
+    with open(path, "w", encoding="utf-8") as f:
+        first = True
+        for p in paragraphs(size, seed):
+            f.write(p if first else "\n\n" + p)
+            first = False
+def write_docx(path: str, size: int, seed: int = 7):
+    from docx import Document
+    doc = Document()
+    for p in paragraphs(size, seed):
+        doc.add_paragraph(p)
+    doc.save(path)
+def _pdf_lines(size: int, seed: int) -> Iterator[str]:
+    for p in paragraphs(size, seed):
+        words, line = p.split(" "), ""
+        for w in words:
+            if line and len(line) + 1 + len(w) > _LINE:
+                yield line
+                line = w
+            else:
+                line = f"{line} {w}" if line else w
+        yield line
+        yield ""
+def write_pdf(path: str, size: int, seed: int = 7):
+    """Minimal PDF 1.4 with one Helvetica text block per page; streamed, so 100 MB is fine."""
+    offsets: List[int] = []
+    page_ids: List[int] = []
+    with open(path, "wb") as f:
+        def obj(num: int, body: bytes):
+            while len(offsets) < num:
+                offsets.append(0)
+            offsets[num - 1] = f.tell()
+            f.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+        f.write(b"%PDF-1.4\n")
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        nxt = 4
+        def page(lines: List[str]):
+            nonlocal nxt
+            ops = [b"BT /F1 9 Tf 11 TL 40 800 Td"]
+            for ln in lines:
+                esc = ln.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+                ops.append(b"(" + esc.encode("latin-1", "replace") + b") Tj T*")
+            ops.append(b"ET")
+            content = b"\n".join(ops)
+            obj(nxt, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+            obj(nxt + 1, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                         b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % nxt)
+            page_ids.append(nxt + 1)
+            nxt += 2
+        buf: List[str] = []
+        for ln in _pdf_lines(size, seed):
+            buf.append(ln)
+            if len(buf) == _LINES_PER_PAGE:
+                page(buf)
+                buf = []
+        if buf or not page_ids:
+            page(buf)
+        kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+        obj(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        for off in offsets:
+            f.write(b"%010d 00000 n \n" % off)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+def ensure(corpus_dir: str, fmt: str, size: int, seed: int = 7) -> str:
+    """Path of the generated file, creating it on first use (files are reused across runs)."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir, f"doc_{size}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        tmp = path + ".part"
+        WRITERS[fmt](tmp, size, seed)
+        os.replace(tmp, path)
+    return path
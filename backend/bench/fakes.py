@@ -0,0 +1,121 @@
+"""
+Offline stand-ins for the external services, shared by the benchmark and load scripts.
+
+FakeChromaStore has the interface of vector_store._ChromaStore (add / query / get /
+get_embeddings / get_by_document / max_batch) and keeps everything in memory, ranking by
+inner product like the normalized l2 ranking of the real collection.
+
+fake_ollama_app is an ASGI app answering /api/chat and /api/generate like Ollama does, with a
+configurable time to first token and per-token delay.
+"""
+import asyncio, json, os, shutil, tempfile, threading
+from typing import Dict, List, Optional
+import numpy as np
+class FakeChromaStore:
+    def __init__(self, dim: int, max_batch: int | None = 5461):
+        self.dim = dim
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._vecs = np.zeros((1024, dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._docs: List[str] = []
+        self._metas: List[Dict] = []
+        self._row: Dict[str, int] = {}
+        self._by_doc: Dict[str, List[int]] = {}
+    @property
+    def count(self) -> int:
+        return len(self._ids)
+    def add(self, ids, documents, metadatas, embeddings):
+        if self.max_batch and len(ids) > self.max_batch:
+            raise ValueError(f"batch of {len(ids)} exceeds max_batch {self.max_batch}")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            for i, id_ in enumerate(ids):
+                if id_ in self._row:
+                    continue  # like Chroma's add: existing ids are left alone
+                row = len(self._ids)
+                if row == len(self._vecs):
+                    self._vecs = np.concatenate([self._vecs, np.zeros_like(self._vecs)])
+                self._vecs[row] = embeddings[i]
+                self._ids.append(id_)
+                self._docs.append(documents[i])
+                self._metas.append(metadatas[i])
+                self._row[id_] = row
+                doc_id = (metadatas[i] or {}).get("document_id")
+                if doc_id is not None:
+                    self._by_doc.setdefault(str(doc_id), []).append(row)
+    def _hit(self, row: int, with_embeddings: bool = False) -> Dict:
+        hit = {"id": self._ids[row], "text": self._docs[row], "metadata": self._metas[row]}
+        if with_embeddings:
+            hit["embedding"] = self._vecs[row].copy()
+        return hit
+    def query(self, qvec, top_k: int, document_id: Optional[str] = None, with_embeddings: bool = False) -> List[Dict]:
+        q = np.asarray(qvec, dtype=np.float32)
+        with self._lock:
+            rows = np.asarray(self._by_doc.get(str(document_id), []) if document_id else np.arange(self.count), dtype=np.int64)
+            if not len(rows):
+                return []
+            scores = self._vecs[rows] @ q
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            return [self._hit(int(rows[i]), with_embeddings) for i in best]
+    def get(self, ids: List[str], with_embeddings: bool = False) -> List[Dict]:
+        with self._lock:
+            return [self._hit(self._row[i], with_embeddings) for i in ids if i in self._row]
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            return {i: self._vecs[self._row[i]].copy() for i in ids if i in self._row}
+    def get_by_document(self, document_id: str, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            return [self._hit(r) for r in self._by_doc.get(str(document_id), [])[:limit]]
+def install_fake_store(bm25: bool = True) -> FakeChromaStore:
+    """
+    Point app.services.vector_store at a fresh FakeChromaStore (and a throwaway BM25 directory).
+    The retrieval cache is turned off so every search does the real work.
+    """
+    from app.core.config import settings
+    from app.services import vector_store as vs
+    store = FakeChromaStore(vs.EMBED_DIM)
+    settings.retrieval_cache_backend = "off"
+    vs._retrieval_cache = None
+    vs._store = store
+    settings.bm25_enabled = bm25
+    vs._bm25 = None
+    if bm25:
+        old = getattr(install_fake_store, "_bm25_dir", None)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+        settings.bm25_dir = install_fake_store._bm25_dir = tempfile.mkdtemp(prefix="bench-bm25-")
+    return store
+def cleanup():
+    d = getattr(install_fake_store, "_bm25_dir", None)
+    if d and os.path.isdir(d):
+        shutil.rmtree(d, ignore_errors=True)
+def fake_ollama_app(ttft_s: float = 0.05, token_s: float = 0.02, tokens: int = 32):
+    """Ollama stand-in: streams NDJSON `tokens` deltas (or one JSON body when stream is false)."""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+    words = [f"word{i} " for i in range(tokens)]
+    def handler(kind: str):
+        def frame(text: str, done: bool = False) -> Dict:
+            if kind == "chat":
+                return {"message": {"role": "assistant", "content": text}, "done": done}
+            return {"response": text, "done": done}
+        async def endpoint(request):
+            body = await request.json()
+            if body.get("stream") is False:
+                await asyncio.sleep(ttft_s + token_s * max(tokens - 1, 0))
+                return JSONResponse(frame("".join(words), True))
+            async def gen():
+                await asyncio.sleep(ttft_s)
+                for i, w in enumerate(words):
+                    if i:
+                        await asyncio.sleep(token_s)
+                    yield json.dumps(frame(w)) + "\n"
+                yield json.dumps(frame("", True)) + "\n"
+            return StreamingResponse(gen(), media_type="application/x-ndjson")
+        return endpoint
+    return Starlette(routes=[Route("/api/chat", handler("chat"), methods=["POST"]),
+                             Route("/api/generate", handler("generate"), methods=["POST"])])
@@ -0,0 +1,303 @@
+"""
+End-to-end load generator: the real FastAPI app (app.main) under uvicorn in this process, with
+offline stand-ins for what it talks to - the in-memory Chroma store from bench.fakes,
+mongomock_motor (or a real server via --mongo-uri) and a fake Ollama with configurable latency.
+
+    cd backend && python -m bench.load --users 8,32,64 --duration 20 --mix ask=6,chat=3,upload=1
+    cd backend && python -m bench.load --users 16 --ttft-ms 300 --token-ms 40 --out load.json
+
+Each virtual user picks a scenario by weight, runs it, thinks for --think-ms and repeats (closed
+loop). Every --users level reports requests/s, p50/p95/p99 latency and errors per scenario,
+time to first token for the SSE scenarios and the lag of the app's event loop, which is what a
+single worker saturates. The client and the stand-ins share the process (and the GIL) with the
+app, so treat the numbers as a lower bound for a dedicated worker.
+"""
+import argparse, asyncio, json, os, platform, random, shutil, sys, tempfile, threading, time, uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import httpx
+import numpy as np
+SCENARIOS = ("ask", "ask_stream", "chat", "upload")
+class _Server:
+    """uvicorn serving `app` on 127.0.0.1 (free port) from its own thread and event loop."""
+    def __init__(self, app, lifespan: str = "on", lag_interval_s: float | None = None,
+                 before: Optional[Callable[[], None]] = None):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, lifespan=lifespan,
+                                                    log_level="warning", access_log=False))
+        self.lag_interval_s = lag_interval_s
+        self.lag: List[tuple] = []  # (perf_counter, lag seconds)
+        self.before = before
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self._run, name="bench-server", daemon=True)
+    async def _probe(self):
+        # a sleep that wakes up late means the loop was busy with something else for that long
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.lag_interval_s)
+            t1 = time.perf_counter()
+            self.lag.append((t1, max(0.0, t1 - t0 - self.lag_interval_s)))
+    async def _main(self):
+        if self.before:
+            self.before()
+        probe = asyncio.create_task(self._probe()) if self.lag_interval_s else None
+        try:
+            await self.server.serve()
+        finally:
+            if probe:
+                probe.cancel()
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except BaseException as e:
+            self.error = e
+    def start(self, timeout: float = 60.0) -> "_Server":
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise SystemExit(f"server failed to start: {self.error!r}")
+            time.sleep(0.02)
+        return self
+    @property
+    def url(self) -> str:
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+    def lag_between(self, t0: float, t1: float) -> List[float]:
+        return [lag for t, lag in list(self.lag) if t0 <= t <= t1]
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+def _configure(args, tmp: str, ollama_url: str):
+    """Point the app at the stand-ins. Must run before app.main is imported (chat reads env at import)."""
+    os.environ["LLM_PRIMARY"] = "ollama"
+    os.environ["OLLAMA_URL"] = ollama_url
+    os.environ.pop("OPENAI_API_KEY", None)
+    os.environ.pop("OLLAMA_USE_GENERATE", None)
+    from app.core.config import settings
+    from bench.fakes import install_fake_store
+    settings.openai_api_key = None
+    settings.llm_provider = "ollama"
+    settings.ollama_base_url = ollama_url
+    settings.file_storage_dir = os.path.join(tmp, "files")
+    settings.answer_cache_enabled = args.answer_cache
+    settings.answer_cache_path = os.path.join(tmp, "answer_cache.sqlite3")
+    settings.mongo_db = f"bkp_load_{os.getpid()}"
+    if args.mongo_uri:
+        settings.mongo_uri = args.mongo_uri
+    install_fake_store()
+def _use_mongomock():
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("mongomock_motor is not installed: pip install mongomock-motor, or pass --mongo-uri")
+    import app.core.db as db
+    db._client = AsyncMongoMockClient()  # created on the server's loop
+def _pcts(values: List[float], prefix: str = "") -> Dict:
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    return {f"{prefix}p50_ms": round(float(np.percentile(ms, 50)), 2),
+            f"{prefix}p95_ms": round(float(np.percentile(ms, 95)), 2),
+            f"{prefix}p99_ms": round(float(np.percentile(ms, 99)), 2),
+            f"{prefix}max_ms": round(float(ms.max()), 2)}
+class _Result:
+    __slots__ = ("latency", "ttft", "error")
+    def __init__(self, latency: float, ttft: float | None = None, error: str | None = None):
+        self.latency, self.ttft, self.error = latency, ttft, error
+class _Ctx:
+    def __init__(self, args, doc_ids: List[str], queries: List[str], upload_text: str):
+        self.args, self.doc_ids, self.queries, self.upload_text = args, doc_ids, queries, upload_text
+async def _ask(client: httpx.AsyncClient, ctx: _Ctx, rnd: random.Random) -> _Result:
+    t0 = time.perf_counter()
+    r = await client.post("/api/knowledge/ask", json={"query": rnd.choice(ctx.queries),
+                                                      "document_id": rnd.choice(ctx.doc_ids)})
+    return _Result(time.perf_counter() - t0, error=None if r.status_code == 200 else str(r.status_code))
+async def _sse(client: httpx.AsyncClient, path: str, body: Dict) -> _Result:
+    t0 = time.perf_counter()
+    ttft, error, done = None, None, False
+    async with client.stream("POST", path, json=body) as r:
+        if r.status_code != 200:
+            await r.aread()
+            return _Result(time.perf_counter() - t0, error=str(r.status_code))
+        async for line in r.aiter_lines():
+            if not line.startswith("event: "):
+                continue
+            event = line[len("event: "):]
+            if event == "token" and ttft is None:
+                ttft = time.perf_counter() - t0
+            elif event == "error":
+                error = "sse_error"
+            elif event == "done":
+                done = True
+    if not done and error is None:
+        error = "incomplete"
+    return _Result(time.perf_counter() - t0, ttft, error)
+async def _ask_stream(client, ctx: _Ctx, rnd: random.Random) -> _Result:
+    return await _sse(client, "/api/knowledge/ask/stream", {"query": rnd.choice(ctx.queries),
+                                                            "document_id": rnd.choice(ctx.doc_ids)})
+async def _chat(client, ctx: _Ctx, rnd: random.Random) -> _Result:
+    return await _sse(client, "/api/chat/stream", {"prompt": rnd.choice(ctx.queries)})
+async def _upload(client, ctx: _Ctx, rnd: random.Random) -> _Result:
+    # a unique first line so the sha256 dedup does not short-circuit the ingestion pipeline
+    name = f"load-{uuid.uuid4().hex}.txt"
+    data = f"{name}\n\n{ctx.upload_text}".encode("utf-8")
+    t0 = time.perf_counter()
+    r = await client.post("/api/documents/upload", files={"file": (name, data, "text/plain")})
+    return _Result(time.perf_counter() - t0, error=None if r.status_code == 202 else str(r.status_code))
+_RUN = {"ask": _ask, "ask_stream": _ask_stream, "chat": _chat, "upload": _upload}
+def parse_mix(s: str) -> Dict[str, float]:
+    mix = {}
+    for part in s.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r} (expected one of {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    if not mix or not any(mix.values()):
+        raise SystemExit("--mix needs at least one scenario with a positive weight")
+    return mix
+async def _seed(client: httpx.AsyncClient, args, text: str) -> List[str]:
+    """Upload --docs documents through the API and wait for their ingestion jobs to finish."""
+    jobs = []
+    for i in range(args.docs):
+        data = f"Seed document {i}\n\n{text}".encode("utf-8")
+        r = await client.post("/api/documents/upload", files={"file": (f"seed-{i}.txt", data, "text/plain")})
+        r.raise_for_status()
+        jobs.append(r.json())
+    doc_ids, deadline = [], time.monotonic() + args.seed_timeout
+    for job in jobs:
+        while job.get("job_id") and job["status"] not in ("done", "failed"):
+            if time.monotonic() > deadline:
+                raise SystemExit(f"seed ingestion did not finish within {args.seed_timeout}s")
+            await asyncio.sleep(0.1)
+            job = dict(job, **(await client.get(f"/api/documents/jobs/{job['job_id']}")).json())
+        if job["status"] != "done":
+            raise SystemExit(f"seed ingestion failed: {job.get('error')}")
+        doc_ids.append(job["document_id"])
+    return doc_ids
+async def run_level(client: httpx.AsyncClient, ctx: _Ctx, users: int, server: _Server) -> Dict:
+    args = ctx.args
+    names, weights = list(args.mix), list(args.mix.values())
+    results: Dict[str, List[_Result]] = {n: [] for n in names}
+    start = time.perf_counter()
+    measure_from, stop_at = start + args.warmup, start + args.warmup + args.duration
+    async def user(i: int):
+        rnd = random.Random(args.seed * 100003 + users * 1009 + i)
+        while (t := time.perf_counter()) < stop_at:
+            name = rnd.choices(names, weights)[0]
+            try:
+                res = await _RUN[name](client, ctx, rnd)
+            except httpx.HTTPError as e:
+                res = _Result(time.perf_counter() - t, error=e.__class__.__name__)
+            if t >= measure_from:
+                results[name].append(res)
+            if args.think_ms:
+                await asyncio.sleep(rnd.expovariate(1000.0 / args.think_ms))
+    await asyncio.gather(*(user(i) for i in range(users)))
+    elapsed = time.perf_counter() - measure_from
+    scenarios, total, total_errors = {}, 0, 0
+    for name, rs in results.items():
+        errors = Counter(r.error for r in rs if r.error)
+        ok = [r for r in rs if not r.error]
+        row = {"requests": len(rs), "ok": len(ok), "errors": dict(errors),
+               "throughput_rps": round(len(ok) / elapsed, 2), **_pcts([r.latency for r in ok])}
+        if name in ("ask_stream", "chat"):
+            row.update(_pcts([r.ttft for r in ok if r.ttft is not None], "ttft_"))
+        scenarios[name] = row
+        total += len(rs)
+        total_errors += sum(errors.values())
+    lag = server.lag_between(measure_from, time.perf_counter())
+    metrics = (await client.get("/api/metrics")).json()
+    return {"users": users, "elapsed_s": round(elapsed, 2), "requests": total, "errors": total_errors,
+            "throughput_rps": round((total - total_errors) / elapsed, 2),
+            "loop_lag": {"samples": len(lag), **_pcts(lag)}, "scenarios": scenarios, "app_metrics": metrics}
+def _print_level(level: Dict):
+    lag = level["loop_lag"]
+    print(f"users {level['users']:4d}  {level['throughput_rps']:9.2f} req/s  errors {level['errors']}  "
+          f"loop lag p99 {lag.get('p99_ms', 0):.1f} ms max {lag.get('max_ms', 0):.1f} ms", file=sys.stderr)
+    for name, s in level["scenarios"].items():
+        ttft = f"  ttft p50 {s['ttft_p50_ms']:8.1f} p95 {s['ttft_p95_ms']:8.1f}" if "ttft_p50_ms" in s else ""
+        print(f"  {name:10s} {s['throughput_rps']:8.2f} req/s  p50 {s.get('p50_ms', 0):8.1f} "
+              f"p95 {s.get('p95_ms', 0):8.1f} p99 {s.get('p99_ms', 0):8.1f} ms{ttft}  errors {s['errors']}",
+              file=sys.stderr)
+async def _drive(args, app_server: _Server) -> List[Dict]:
+    from bench.corpus import queries, text
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=app_server.url, timeout=args.timeout, limits=limits) as client:
+        doc_ids = await _seed(client, args, text(args.doc_size))
+        ctx = _Ctx(args, doc_ids, queries(args.queries), text(args.upload_size, seed=8))
+        levels = []
+        for users in args.users:
+            level = await run_level(client, ctx, users, app_server)
+            _print_level(level)
+            levels.append(level)
+        return levels
+async def _drop_db():
+    # a fresh client: the app's one belongs to the server thread's (closed) loop
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from app.core.config import settings
+    client = AsyncIOMotorClient(settings.mongo_uri)
+    await client.drop_database(settings.mongo_db)
+    client.close()
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", default="8,32", help="concurrent virtual users, one run per comma-separated level")
+    ap.add_argument("--duration", type=float, default=20.0, help="measured seconds per level")
+    ap.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before each level")
+    ap.add_argument("--mix", default="ask=5,ask_stream=2,chat=2,upload=1",
+                    help=f"scenario weights, e.g. ask=6,chat=3,upload=1 ({', '.join(SCENARIOS)})")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean (exponential) pause between a user's requests")
+    ap.add_argument("--ttft-ms", type=float, default=50.0, help="fake Ollama delay before the first token")
+    ap.add_argument("--token-ms", type=float, default=20.0, help="fake Ollama delay between tokens")
+    ap.add_argument("--tokens", type=int, default=32, help="tokens per fake Ollama answer")
+    ap.add_argument("--docs", type=int, default=4, help="documents ingested before the run (ask targets)")
+    ap.add_argument("--doc-size", default="256KB")
+    ap.add_argument("--upload-size", default="64KB")
+    ap.add_argument("--queries", type=int, default=500, help="distinct questions the users draw from")
+    ap.add_argument("--answer-cache", action="store_true", help="keep the answer cache on (off by default)")
+    ap.add_argument("--mongo-uri", help="use this MongoDB (a throwaway database) instead of mongomock_motor")
+    ap.add_argument("--keep-db", action="store_true", help="do not drop the --mongo-uri database afterwards")
+    ap.add_argument("--lag-interval-ms", type=float, default=10.0)
+    ap.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    ap.add_argument("--seed-timeout", type=float, default=300.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write the JSON report here (default: stdout)")
+    args = ap.parse_args()
+    from bench.bench_stages import parse_size
+    from bench.fakes import cleanup, fake_ollama_app
+    args.users = [int(u) for u in args.users.split(",") if u.strip()]
+    args.mix = parse_mix(args.mix)
+    args.doc_size, args.upload_size = parse_size(args.doc_size), parse_size(args.upload_size)
+    tmp = tempfile.mkdtemp(prefix="bench-load-")
+    ollama = _Server(fake_ollama_app(args.ttft_ms / 1000, args.token_ms / 1000, args.tokens), lifespan="off").start()
+    app_server = None
+    try:
+        _configure(args, tmp, ollama.url)
+        from app.main import app
+        app_server = _Server(app, lag_interval_s=args.lag_interval_ms / 1000,
+                             before=None if args.mongo_uri else _use_mongomock).start()
+        levels = asyncio.run(_drive(args, app_server))
+    finally:
+        if app_server:
+            app_server.stop()
+            if args.mongo_uri and not args.keep_db:
+                asyncio.run(_drop_db())
+        ollama.stop()
+        cleanup()
+        shutil.rmtree(tmp, ignore_errors=True)
+    report = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count(),
+                       "mongo": "uri" if args.mongo_uri else "mongomock",
+                       "config": {k: v for k, v in vars(args).items() if k not in ("out", "mongo_uri")}},
+              "levels": levels}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+if __name__ == "__main__":
+    main()